@@ -3,7 +3,7 @@
 import os
 from rag.project_paths import get_s3_prefix, get_local_folder
 from rag.pipeline_utils import (
-    list_s3_files, download_s3_file,
+    sync_s3_prefix,
     list_local_files, load_documents, chunk_documents
 )
 from dotenv import load_dotenv
@@ -18,15 +18,9 @@ s3_prefix = get_s3_prefix(portfolio, opportunity)
 local_folder = get_local_folder(portfolio, opportunity)
 
 # Step 1: Download files from S3
-print(f"\n🔍 Listing files in S3 under: {s3_prefix}")
-s3_keys = list_s3_files(bucket, prefix=s3_prefix)
-print(f"✅ Found {len(s3_keys)} files")
-
-for key in s3_keys:
-    filename = key.split("/")[-1]
-    dest_path = os.path.join(local_folder, filename)
-    download_s3_file(bucket, key, dest_path)
-    print(f"⬇️ Downloaded {key} → {dest_path}")
+print(f"\n🔍 Syncing files from S3 under: {s3_prefix}")
+synced = sync_s3_prefix(bucket, s3_prefix, local_folder)
+print(f"✅ {len(synced)} files in {local_folder}")
 
 # Step 2: Load and chunk
 print("\n📄 Loading documents...")
@@ -0,0 +1,267 @@
+# rag/bedrock_stub.py — local stand-in for bedrock-runtime InvokeModel, for concurrency and throttling load tests
+#
+#   python -m rag.bedrock_stub serve --port 8787 --latency lognormal:900,0.35 --throttle-rate 0.02
+#   BEDROCK_ENDPOINT_URL=http://127.0.0.1:8787 python run_solicitation_analysis.py <portfolio> <opportunity>
+#
+#   python -m rag.bedrock_stub loadtest --levels 1,8,32,128 --requests 256
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+INVOKE_PATH = re.compile(r"^/model/(?P<model_id>[^/]+)/invoke$")
+DEFAULT_REPLY = "Score: 0.5\nRationale: Stub response from the local Bedrock stand-in."
+
+
+def parse_latency(spec: str):
+    """
+    Latency distribution in milliseconds:
+    fixed:MS | uniform:LOW,HIGH | normal:MEAN,SD | lognormal:MEDIAN,SIGMA
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class StubConfig:
+    def __init__(self, latency="lognormal:800,0.35", throttle_rate=0.0, max_concurrency=0,
+                 ms_per_input_token=0.0, ms_per_output_token=0.0, output_tokens=60,
+                 time_scale=1.0, seed=0, recordings=None):
+        self.sample_latency = parse_latency(latency)
+        self.throttle_rate = throttle_rate
+        self.max_concurrency = max_concurrency
+        self.ms_per_input_token = ms_per_input_token
+        self.ms_per_output_token = ms_per_output_token
+        self.output_tokens = output_tokens
+        self.time_scale = time_scale
+        self.rng = random.Random(seed)
+        self.responses = {}
+        if recordings:
+            from rag.llm_client_claude import cache_key
+            with open(recordings, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.responses.setdefault(entry["key"], entry["response"])
+            self._cache_key = cache_key
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {"requests": 0, "throttled": 0, "served": 0, "peak_in_flight": 0}
+
+
+def make_handler(config: StubConfig):
+    class BedrockStubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("x-amzn-RequestId", str(uuid.uuid4()))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            match = INVOKE_PATH.match(unquote(self.path.split("?")[0]))  # botocore sends "v1%3A0"
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length) if length else b""
+            if not match:
+                self._send(404, {"message": f"Unknown operation {self.path}"},
+                           {"x-amzn-ErrorType": "UnknownOperationException"})
+                return
+
+            with config.lock:
+                config.stats["requests"] += 1
+                throttled = (config.rng.random() < config.throttle_rate
+                             or (config.max_concurrency and config.in_flight >= config.max_concurrency))
+                if throttled:
+                    config.stats["throttled"] += 1
+                else:
+                    config.in_flight += 1
+                    config.stats["peak_in_flight"] = max(config.stats["peak_in_flight"], config.in_flight)
+                    base_ms = config.sample_latency(config.rng)
+            if throttled:
+                self._send(429, {"message": "Too many requests, please wait before trying again."},
+                           {"x-amzn-ErrorType": "ThrottlingException"})
+                return
+
+            try:
+                request = json.loads(raw or b"{}")
+                turns = {"user": "", "assistant": ""}
+                for m in request.get("messages", []):
+                    turns[m.get("role", "user")] = (
+                        m["content"] if isinstance(m.get("content"), str)
+                        else "".join(part.get("text", "") for part in m.get("content", []))
+                    )
+                prompt = turns["user"]
+                text = DEFAULT_REPLY
+                if config.responses:
+                    # A trailing assistant turn is a continuation prefill, keyed the same way the client caches it
+                    key = config._cache_key(prompt, request.get("temperature", 0.0),
+                                            request.get("max_tokens", 1000), match.group("model_id"),
+                                            prefill=turns["assistant"])
+                    text = config.responses.get(key, text)
+
+                input_tokens = len(prompt) // 4 + 1
+                output_tokens = min(request.get("max_tokens", 1000), max(config.output_tokens, len(text) // 4 + 1))
+                delay_ms = (base_ms + input_tokens * config.ms_per_input_token
+                            + output_tokens * config.ms_per_output_token)
+                time.sleep(delay_ms * config.time_scale / 1000.0)
+
+                self._send(200, {
+                    "id": f"msg_stub_{uuid.uuid4().hex[:16]}",
+                    "type": "message",
+                    "role": "assistant",
+                    "model": match.group("model_id"),
+                    "content": [{"type": "text", "text": text}],
+                    "stop_reason": "end_turn",
+                    "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+                })
+                with config.lock:
+                    config.stats["served"] += 1
+            finally:
+                with config.lock:
+                    config.in_flight -= 1
+
+    return BedrockStubHandler
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # the default backlog of 5 resets connections at high in-flight levels
+
+
+def start_stub(config: StubConfig, host: str = "127.0.0.1", port: int = 0):
+    """Start the stub on a background thread; returns (server, endpoint_url). Stop with server.shutdown()."""
+    server = StubServer((host, port), make_handler(config))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def run_load_test(config: StubConfig, levels, requests_per_level: int):
+    """
+    Drive invoke_claude through llm_pool at each in-flight level against an in-process stub.
+    Each level gets fresh rate controls whose AIMD limit starts and is capped at that level, so the
+    level is the concurrency actually offered (until the stub throttles) and levels don't depend on order.
+    """
+    from rag import rate_control
+    from rag.llm_client_claude import invoke_claude, set_bedrock_endpoint, set_llm_mode
+    from rag.llm_pool import run_in_pool
+
+    server, endpoint_url = start_stub(config)
+    set_bedrock_endpoint(endpoint_url)
+    set_llm_mode("live")
+
+    print(f"🧪 Bedrock stub at {endpoint_url}")
+    results = []
+    try:
+        for level in levels:
+            latencies = []
+
+            def call(i):
+                started = time.perf_counter()
+                invoke_claude(f"load test request {level}-{i}", use_cache=False)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+            rate_control.reset_controls(initial=level, maximum=level)
+            with config.lock:
+                config.stats["peak_in_flight"] = 0
+            before = dict(config.stats)
+            started = time.perf_counter()
+            outcomes = run_in_pool(call, range(requests_per_level), max_in_flight=level)
+            elapsed = time.perf_counter() - started
+            errors = sum(1 for o in outcomes if isinstance(o, Exception))
+            row = {
+                "in_flight": level,
+                "requests": requests_per_level,
+                "errors": errors,
+                "throttled_responses": config.stats["throttled"] - before["throttled"],
+                "peak_in_flight": config.stats["peak_in_flight"],
+                "elapsed_s": round(elapsed, 2),
+                "throughput_rps": round((requests_per_level - errors) / elapsed, 2) if elapsed else 0.0,
+                "p50_ms": round(_percentile(latencies, 50), 1),
+                "p95_ms": round(_percentile(latencies, 95), 1),
+                "p99_ms": round(_percentile(latencies, 99), 1),
+            }
+            results.append(row)
+            print(f"   in-flight {level:>4}: {row['throughput_rps']:>7} req/s  p50 {row['p50_ms']} ms  "
+                  f"p95 {row['p95_ms']} ms  peak {row['peak_in_flight']}  throttled {row['throttled_responses']}  errors {errors}")
+    finally:
+        rate_control.reset_controls()
+        server.shutdown()
+    return results
+
+
+def _config_from_args(args) -> StubConfig:
+    return StubConfig(latency=args.latency, throttle_rate=args.throttle_rate, max_concurrency=args.max_concurrency,
+                      ms_per_input_token=args.ms_per_input_token, ms_per_output_token=args.ms_per_output_token,
+                      output_tokens=args.output_tokens, time_scale=args.time_scale, seed=args.seed,
+                      recordings=args.recordings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Bedrock InvokeModel stand-in")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("serve", "loadtest"):
+        p = sub.add_parser(name)
+        p.add_argument("--latency", default="lognormal:800,0.35",
+                       help="fixed:MS | uniform:LOW,HIGH | normal:MEAN,SD | lognormal:MEDIAN,SIGMA")
+        p.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+        p.add_argument("--max-concurrency", type=int, default=0, help="Throttle beyond this many in flight (0 = unlimited)")
+        p.add_argument("--ms-per-input-token", type=float, default=0.0)
+        p.add_argument("--ms-per-output-token", type=float, default=0.0)
+        p.add_argument("--output-tokens", type=int, default=60, help="Minimum output tokens reported per response")
+        p.add_argument("--time-scale", type=float, default=1.0, help="Multiply every delay (e.g. 0.1 for quick runs)")
+        p.add_argument("--seed", type=int, default=0)
+        p.add_argument("--recordings", default=None, help="Serve responses from an LLM_MODE=record file when keys match")
+    sub.choices["serve"].add_argument("--host", default="127.0.0.1")
+    sub.choices["serve"].add_argument("--port", type=int, default=8787)
+    sub.choices["loadtest"].add_argument("--levels", default="1,8,32,128")
+    sub.choices["loadtest"].add_argument("--requests", type=int, default=256, help="Requests per in-flight level")
+    sub.choices["loadtest"].add_argument("--output", default=None, help="Write results JSON here")
+    args = parser.parse_args()
+
+    config = _config_from_args(args)
+    if args.command == "serve":
+        server = StubServer((args.host, args.port), make_handler(config))
+        print(f"🧪 Bedrock stub listening on http://{args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print(f"\n📊 {config.stats}")
+    else:
+        results = run_load_test(config, [int(v) for v in args.levels.split(",")], args.requests)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            print(f"📄 Saved load test results to: {args.output}")
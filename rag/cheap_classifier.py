@@ -0,0 +1,325 @@
+# rag/cheap_classifier.py — local CPU cascade that settles obvious eval_criteria_identifier negatives before Claude
+#
+#   python -m rag.cheap_classifier train        # (re)train from every prior tagged_chunks artifact under data/
+#
+# Hashed word uni/bigrams + Section M keyword rules feed a logistic regression trained on the scores Claude gave
+# in earlier runs. Chunks the model is confident are negative get 0.0 without a call; keyword hits and anything
+# ambiguous go to Claude as before. A small audit sample of would-be skips is still sent so agreement is measured.
+
+import glob
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+import zlib
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from rag import metrics
+from rag.chunk_store import iter_chunks, resolve_chunks_path
+
+AGENT = "eval_criteria_identifier"
+MODEL_PATH = os.getenv("CHEAP_CLASSIFIER_PATH", ".cache/eval_criteria_classifier.json")
+HASH_BUCKETS = 2 ** 18
+# Claude scores at or above this count as evaluation criteria; matches the cut-off tag_win_themes uses for criteria text
+POSITIVE_SCORE = 0.7
+# Share of held-out positives the skip threshold may lose (0.0 = below every positive seen in cross-validation)
+CASCADE_MAX_MISS = float(os.getenv("CASCADE_MAX_MISS", "0.0"))
+# The lowest held-out positive is only a sample: the threshold is scaled by this margin, and also kept below
+# the mean - CASCADE_LOGIT_SIGMAS * stdev of the held-out positives' log-odds
+CASCADE_THRESHOLD_MARGIN = float(os.getenv("CASCADE_THRESHOLD_MARGIN", "0.5"))
+CASCADE_LOGIT_SIGMAS = float(os.getenv("CASCADE_LOGIT_SIGMAS", "2.0"))
+# With fewer labelled positives than this, the cascade trains but never skips a chunk
+CASCADE_MIN_POSITIVES = int(os.getenv("CASCADE_MIN_POSITIVES", "50"))
+# Share of would-be skips still sent to Claude to keep measuring agreement
+CASCADE_AUDIT_RATE = float(os.getenv("CASCADE_AUDIT_RATE", "0.05"))
+MIN_TRAINING_EXAMPLES = 40
+EPOCHS = 8
+LEARNING_RATE = 2.0
+L2 = 1e-5
+
+TOKEN_REGEX = re.compile(r"[a-z][a-z0-9]+")
+# Language that always goes to Claude, whatever the model says
+EVAL_RULES = {
+    "section_m": re.compile(r"\bsection\s+m\b", re.IGNORECASE),
+    "basis_for_award": re.compile(r"\bbasis\s+(?:for|of)\s+(?:the\s+)?award\b", re.IGNORECASE),
+    "evaluation_factor": re.compile(r"\b(?:evaluation|technical)\s+(?:sub)?factors?\b|\bsub-?factors?\b|\bfactor\s+\d+\b", re.IGNORECASE),
+    "will_be_evaluated": re.compile(r"\b(?:will|shall)\s+(?:be\s+evaluated|evaluate|assess)\b|\bevaluation\s+(?:criteria|process|methodology)\b", re.IGNORECASE),
+    "best_value": re.compile(r"\bbest[- ]value\b|\btrade-?off\b|\blowest\s+price\s+technically\s+acceptable\b|\bLPTA\b"
+                             r"|\bprice\s+premium\b|\btechnical(?:ly)?\s+(?:merit|rated)\b", re.IGNORECASE),
+    "rating_scale": re.compile(r"\b(?:adjectival|confidence)\s+ratings?\b|\b(?:outstanding|acceptable|marginal|unacceptable)\b.{0,40}\brating\b"
+                               r"|\b(?:high|some|low)\s+confidence\b", re.IGNORECASE),
+}
+
+
+# === Features ===
+def _bucket(feature: str) -> int:
+    return zlib.crc32(feature.encode("utf-8")) % HASH_BUCKETS
+
+
+def rule_hits(text: str) -> List[str]:
+    return [name for name, regex in EVAL_RULES.items() if regex.search(text)]
+
+
+def featurize(text: str) -> Dict[int, float]:
+    """L2-normalised binary hashed features: word unigrams, bigrams and keyword-rule indicators."""
+    tokens = TOKEN_REGEX.findall(text.lower())
+    buckets = {_bucket(t) for t in tokens}
+    buckets.update(_bucket(f"{a} {b}") for a, b in zip(tokens, tokens[1:]))
+    buckets.update(_bucket(f"rule:{name}") for name in rule_hits(text))
+    if not buckets:
+        return {}
+    value = 1.0 / math.sqrt(len(buckets))
+    return {b: value for b in buckets}
+
+
+def _sigmoid(z: float) -> float:
+    if z < -30:
+        return 0.0
+    if z > 30:
+        return 1.0
+    return 1.0 / (1.0 + math.exp(-z))
+
+
+def _fit(examples, seed: int = 0):
+    """SGD logistic regression on soft labels (Claude's 0..1 score), returning (weights, bias)."""
+    weights = defaultdict(float)
+    bias = 0.0
+    order = list(range(len(examples)))
+    rng = random.Random(seed)
+    for epoch in range(EPOCHS):
+        rng.shuffle(order)
+        lr = LEARNING_RATE / (1 + epoch)
+        for i in order:
+            features, label = examples[i]
+            grad = _sigmoid(bias + sum(weights[f] * v for f, v in features.items())) - label
+            bias -= lr * grad
+            for f, v in features.items():
+                weights[f] -= lr * (grad * v + L2 * weights[f])
+    return weights, bias
+
+
+def _predict(weights, bias: float, features: Dict[int, float]) -> float:
+    return _sigmoid(bias + sum(weights.get(f, 0.0) * v for f, v in features.items()))
+
+
+def _logit(p: float) -> float:
+    p = min(1 - 1e-9, max(1e-9, p))
+    return math.log(p / (1 - p))
+
+
+# === Training ===
+def chunk_label(chunk: Dict) -> Optional[float]:
+    """
+    Claude's eval_criteria score for a chunk, or None if absent or not Claude's answer
+    (settled by this classifier, or the tagger's fallback after a failed call).
+    """
+    metadata = chunk.get("metadata", {})
+    if AGENT in metadata.get("agent_sources", {}):
+        return None
+    score = metadata.get("agent_tags", {}).get(AGENT)
+    return float(score) if isinstance(score, (int, float)) else None
+
+
+def collect_training_chunks(data_root: str = "data") -> List[Dict]:
+    chunks = []
+    for opportunity_dir in sorted(glob.glob(os.path.join(data_root, "*", "opportunities", "*"))):
+        path = resolve_chunks_path(os.path.join(opportunity_dir, "tagged_chunks.jsonl"))
+        if os.path.exists(path):
+            chunks.extend(c for c in iter_chunks(path) if chunk_label(c) is not None)
+    return chunks
+
+
+def train_classifier(chunks: List[Dict], folds: int = 3, seed: int = 0) -> Optional[Dict]:
+    """
+    Fit on every labelled chunk. The skip threshold comes from out-of-fold predictions: it sits
+    below all but CASCADE_MAX_MISS of the held-out positives, so it reflects unseen text, and then
+    further down by CASCADE_THRESHOLD_MARGIN and the log-odds lower bound. Below CASCADE_MIN_POSITIVES
+    positives the threshold is 0.0, which disables skipping.
+    """
+    examples = [(featurize(c["text"]), min(1.0, max(0.0, chunk_label(c)))) for c in chunks if chunk_label(c) is not None]
+    if len(examples) < MIN_TRAINING_EXAMPLES:
+        print(f"⚠️ [cheap_classifier] Only {len(examples)} labelled chunks; need {MIN_TRAINING_EXAMPLES} to train")
+        return None
+
+    rng = random.Random(seed)
+    fold_of = [rng.randrange(folds) for _ in examples]
+    held_out = [0.0] * len(examples)
+    for fold in range(folds):
+        weights, bias = _fit([e for e, f in zip(examples, fold_of) if f != fold], seed)
+        for i, (features, _) in enumerate(examples):
+            if fold_of[i] == fold:
+                held_out[i] = _predict(weights, bias, features)
+
+    positives = sorted(p for p, (_, label) in zip(held_out, examples) if label >= POSITIVE_SCORE)
+    threshold = 0.0
+    if len(positives) >= CASCADE_MIN_POSITIVES:
+        logits = [_logit(p) for p in positives]
+        mean = sum(logits) / len(logits)
+        stdev = math.sqrt(sum((x - mean) ** 2 for x in logits) / (len(logits) - 1))
+        lowest = positives[min(len(positives) - 1, int(CASCADE_MAX_MISS * len(positives)))]
+        threshold = min(CASCADE_THRESHOLD_MARGIN * lowest, _sigmoid(mean - CASCADE_LOGIT_SIGMAS * stdev))
+    else:
+        print(f"⚠️ [cheap_classifier] Only {len(positives)} positive chunks; need {CASCADE_MIN_POSITIVES} "
+              f"before the cascade may skip any")
+    negatives = [p for p, (_, label) in zip(held_out, examples) if label < POSITIVE_SCORE]
+
+    weights, bias = _fit(examples, seed)
+    return {
+        "agent": AGENT,
+        "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "examples": len(examples),
+        "positives": len(positives),
+        "skipping_enabled": threshold > 0.0,
+        "threshold": round(threshold, 6),
+        "cv_negative_skip_rate": round(sum(p < threshold for p in negatives) / len(negatives), 4) if negatives else 0.0,
+        "bias": bias,
+        "weights": {str(f): round(w, 6) for f, w in weights.items() if abs(w) > 1e-6},
+    }
+
+
+def save_classifier(model: Dict, path: str = MODEL_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(model, f)
+
+
+def load_classifier(path: str = MODEL_PATH, train_if_missing: bool = True) -> Optional[Dict]:
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            model = json.load(f)
+    elif train_if_missing:
+        model = train_classifier(collect_training_chunks())
+        if model is None:
+            return None
+        save_classifier(model, path)
+        print(f"🧮 [cheap_classifier] Trained on {model['examples']} prior chunks and saved to {path}")
+    else:
+        return None
+    model["weights"] = {int(f): w for f, w in model["weights"].items()}
+    return model
+
+
+def predict(model: Dict, text: str) -> float:
+    return _predict(model["weights"], model["bias"], featurize(text))
+
+
+# === Cascade ===
+def cascade_eval_criteria(chunks: List[Dict], model: Optional[Dict] = None,
+                          on_tagged: Optional[Callable[[str, float], None]] = None,
+                          audit_rate: float = CASCADE_AUDIT_RATE):
+    """
+    Settle confident negatives locally (score 0.0, agent_sources marks them as cheap_classifier)
+    and return (chunks_for_claude, cascade) where cascade holds per-chunk predictions for the report.
+    Without a trained model every chunk is escalated.
+    """
+    model = model if model is not None else load_classifier()
+    cascade = {"threshold": model["threshold"] if model else None, "predictions": {}, "audited": set(),
+               "skipped": 0, "rule_escalations": 0, "chunks": len(chunks)}
+    if model is None:
+        print("⚠️ [cheap_classifier] No trained model; sending every chunk to Claude")
+        return chunks, cascade
+    if not model.get("skipping_enabled", model["threshold"] > 0.0):
+        print(f"⚠️ [cheap_classifier] Model trained on only {model['positives']} positives; sending every chunk to Claude")
+        return chunks, cascade
+
+    escalate = []
+    for chunk in chunks:
+        chunk_id = chunk["chunk_id"]
+        prob = predict(model, chunk["text"])
+        cascade["predictions"][chunk_id] = prob
+        if prob >= model["threshold"]:
+            escalate.append(chunk)
+        elif rule_hits(chunk["text"]):
+            cascade["rule_escalations"] += 1
+            escalate.append(chunk)
+        elif zlib.crc32(chunk_id.encode("utf-8")) % 10000 < audit_rate * 10000:
+            # Deterministic audit sample, so reruns audit the same chunks
+            cascade["audited"].add(chunk_id)
+            escalate.append(chunk)
+        else:
+            cascade["skipped"] += 1
+            metadata = chunk.setdefault("metadata", {})
+            metadata.setdefault("agent_tags", {})[AGENT] = 0.0
+            metadata.setdefault("agent_sources", {})[AGENT] = "cheap_classifier"
+            if on_tagged:
+                on_tagged(chunk_id, 0.0)
+
+    metrics.inc("cascade_chunks_total", cascade["skipped"], agent=AGENT, route="skipped")
+    metrics.inc("cascade_chunks_total", len(escalate) - len(cascade["audited"]), agent=AGENT, route="escalated")
+    metrics.inc("cascade_chunks_total", len(cascade["audited"]), agent=AGENT, route="audited")
+    print(f"🧮 [cheap_classifier] {cascade['skipped']}/{len(chunks)} chunks settled locally, "
+          f"{len(escalate)} sent to Claude ({len(cascade['audited'])} audits, {cascade['rule_escalations']} keyword rules)")
+    return escalate, cascade
+
+
+def cascade_report(chunks: List[Dict], cascade: Dict) -> Dict:
+    """Skip rate plus agreement between the classifier's call and Claude's score on every chunk Claude saw."""
+    threshold = cascade["threshold"]
+    compared = agree = 0
+    audit_misses = []
+    for chunk in chunks:
+        chunk_id = chunk["chunk_id"]
+        prob = cascade["predictions"].get(chunk_id)
+        metadata = chunk.get("metadata", {})
+        if prob is None or AGENT in metadata.get("agent_sources", {}):
+            continue
+        score = metadata.get("agent_tags", {}).get(AGENT)
+        if not isinstance(score, (int, float)):
+            continue
+        predicted_negative = prob < threshold
+        compared += 1
+        agree += predicted_negative == (score < POSITIVE_SCORE)
+        if chunk_id in cascade["audited"] and score >= POSITIVE_SCORE:
+            audit_misses.append({"chunk_id": chunk_id, "probability": round(prob, 4), "llm_score": score})
+
+    audited = len(cascade["audited"])
+    return {
+        "agent": AGENT,
+        "threshold": threshold,
+        "chunks": cascade["chunks"],
+        "skipped": cascade["skipped"],
+        "skip_rate": round(cascade["skipped"] / cascade["chunks"], 4) if cascade["chunks"] else 0.0,
+        "rule_escalations": cascade["rule_escalations"],
+        "agreement": {
+            "compared": compared,
+            "agree": agree,
+            "rate": round(agree / compared, 4) if compared else None,
+            "audited": audited,
+            "audit_misses": audit_misses,
+            "audit_miss_rate": round(len(audit_misses) / audited, 4) if audited else None,
+        },
+    }
+
+
+def save_cascade_report(report: Dict, output_path: str):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    agreement = report["agreement"]
+    rate = f"{agreement['rate']:.0%}" if agreement["rate"] is not None else "n/a"
+    print(f"🧮 [cheap_classifier] Skip rate {report['skip_rate']:.0%}; agreement with Claude "
+          f"{rate} on {agreement['compared']} chunks, "
+          f"{len(agreement['audit_misses'])} of {agreement['audited']} audited skips were positives")
+    print(f"📄 Saved cascade report to: {output_path}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "train":
+        print("Usage: python -m rag.cheap_classifier train [model_path]")
+        sys.exit(1)
+    path = sys.argv[2] if len(sys.argv) > 2 else MODEL_PATH
+    model = train_classifier(collect_training_chunks())
+    if model is None:
+        sys.exit(1)
+    save_classifier(model, path)
+    if model["skipping_enabled"]:
+        print(f"✅ Trained on {model['examples']} chunks ({model['positives']} positives); skip threshold "
+              f"{model['threshold']:.4f}, cross-validated negative skip rate {model['cv_negative_skip_rate']:.0%}")
+    else:
+        print(f"✅ Trained on {model['examples']} chunks ({model['positives']} positives); skipping stays off "
+              f"until there are {CASCADE_MIN_POSITIVES} positives")
+    print(f"📄 Saved model to: {path}")
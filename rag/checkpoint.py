@@ -0,0 +1,74 @@
+# rag/checkpoint.py — append-only (stage, chunk_id) result log for crash-safe resume
+
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+
+
+class CheckpointLog:
+    """
+    JSONL log with one line per completed (stage, chunk_id) result.
+    Lines are flushed as soon as each chunk finishes, so a crash loses at most the calls in flight.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        self._completed: Dict[str, Dict[str, Any]] = {}
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if resume:
+            self._replay()
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+        if resume and self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")  # fence off a torn final line before appending
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn final line from a crash mid-write
+                self._completed.setdefault(entry["stage"], {})[entry["chunk_id"]] = entry["result"]
+        total = sum(len(v) for v in self._completed.values())
+        print(f"♻️ Replayed {total} checkpointed results from {self.path}")
+
+    def record(self, stage: str, chunk_id: str, result: Any):
+        line = json.dumps({"stage": stage, "chunk_id": chunk_id, "result": result}, ensure_ascii=False)
+        with self._lock:
+            if self._file.closed:
+                return  # a stage still winding down after the run failed
+            self._file.write(line + "\n")
+            self._file.flush()
+            self._completed.setdefault(stage, {})[chunk_id] = result
+
+    def recorder(self, stage: str) -> Callable[[str, Any], None]:
+        """Callback for a tagger's on_tagged hook: records each chunk's result under `stage`."""
+        return lambda chunk_id, result: self.record(stage, chunk_id, result)
+
+    def completed(self, stage: str) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._completed.get(stage, {}))
+
+    def split_pending(self, stage: str, chunks: List[Dict],
+                      apply: Callable[[Dict, Any], None]) -> Tuple[List[Dict], int]:
+        """Apply logged results for `stage` via `apply(chunk, result)`; return (chunks still to run, replayed count)."""
+        done = self.completed(stage)
+        remaining = []
+        for chunk in chunks:
+            if chunk["chunk_id"] in done:
+                apply(chunk, done[chunk["chunk_id"]])
+            else:
+                remaining.append(chunk)
+        return remaining, len(chunks) - len(remaining)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,164 @@
+# rag/chunk_store.py — streaming JSONL storage for tagged chunks (legacy JSON still readable/exportable)
+
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, Iterator
+
+# A writer streams into `<path>.inprogress` and only renames it over the artifact once the run completes
+IN_PROGRESS_SUFFIX = ".inprogress"
+# A writer that was aborted leaves what it had written here, and the previous artifact untouched
+FAILED_SUFFIX = ".failed"
+# A follower gives up when the in-progress file has not grown for this long (writer likely crashed)
+FOLLOW_IDLE_TIMEOUT = float(os.getenv("CHUNK_FOLLOW_IDLE_TIMEOUT", "600"))
+
+
+class IncompleteChunksError(RuntimeError):
+    """A followed artifact was abandoned by its writer before it completed."""
+
+
+class ChunkWriter:
+    """
+    Append tagged chunks to a JSONL file one line at a time as they finish.
+    Lines go to `<path>.inprogress`, which readers can follow while it grows; close() atomically replaces
+    the artifact with it, and abort() moves it to `<path>.failed`. A previous complete artifact therefore
+    stays readable, and is never replaced by a partial one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = None
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if os.path.exists(self.path + FAILED_SUFFIX):
+            os.remove(self.path + FAILED_SUFFIX)
+        self._file = open(self.path + IN_PROGRESS_SUFFIX, "w", encoding="utf-8")
+
+    def write(self, chunk: Dict):
+        line = json.dumps(chunk, ensure_ascii=False)
+        with self._lock:
+            if self._file is None:
+                self._open()
+            elif self._file.closed:
+                return  # closed or aborted; a stage still winding down after a failure
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.count += 1
+
+    def close(self, create_if_empty: bool = True):
+        """Publish the streamed chunks as the complete artifact."""
+        with self._lock:
+            if self._file is None:
+                if not create_if_empty:
+                    return
+                self._open()
+            if self._file.closed:
+                return
+            self._file.close()
+            os.replace(self.path + IN_PROGRESS_SUFFIX, self.path)
+
+    def abort(self):
+        """Keep the partial output as `<path>.failed`, leaving any previous artifact in place."""
+        with self._lock:
+            if self._file is None or self._file.closed:
+                return
+            self._file.close()
+            os.replace(self.path + IN_PROGRESS_SUFFIX, self.path + FAILED_SUFFIX)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_chunks_jsonl(path: str, chunks: Iterable[Dict]) -> int:
+    with ChunkWriter(path) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+        return writer.count
+
+
+def export_chunks_json(path: str, chunks: Iterable[Dict]):
+    """Write the legacy indented JSON array, streaming one chunk at a time."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i, chunk in enumerate(chunks):
+            f.write(",\n  " if i else "\n  ")
+            f.write(json.dumps(chunk, indent=2).replace("\n", "\n  "))
+        f.write("\n]\n")
+
+
+def iter_chunks(path: str, follow: bool = False, poll_seconds: float = 0.5) -> Iterator[Dict]:
+    """
+    Yield chunks from a .jsonl artifact line by line (or from a legacy .json array).
+    With follow=True and a writer still running, read its .inprogress file as it grows instead. Raises
+    IncompleteChunksError if that writer aborts, or goes FOLLOW_IDLE_TIMEOUT seconds without writing.
+    """
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            yield from json.load(f)
+        return
+
+    in_progress = path + IN_PROGRESS_SUFFIX
+    following = False
+    if follow:
+        try:
+            f = open(in_progress, "r", encoding="utf-8")
+            following = True
+        except FileNotFoundError:
+            pass
+    if not following:
+        f = open(path, "r", encoding="utf-8")
+
+    followed = following
+    with f:
+        buffer = ""
+        while True:
+            line = f.readline()
+            if line:
+                buffer += line
+                if buffer.endswith("\n"):
+                    if buffer.strip():
+                        yield json.loads(buffer)
+                    buffer = ""
+                continue
+            if following:
+                try:
+                    idle = time.time() - os.path.getmtime(in_progress)
+                except FileNotFoundError:
+                    # Renamed by the writer: drain what is left, then check whether it completed or aborted
+                    following = False
+                    continue
+                if idle > FOLLOW_IDLE_TIMEOUT:
+                    raise IncompleteChunksError(f"{in_progress} has not grown for {idle:.0f}s; its writer appears to have died")
+                time.sleep(poll_seconds)
+                continue
+            if followed and _is_same_file(f, path + FAILED_SUFFIX):
+                raise IncompleteChunksError(f"The writer of {path} aborted; partial output is in {path + FAILED_SUFFIX}")
+            if buffer.strip():
+                yield json.loads(buffer)
+            return
+
+
+def _is_same_file(f, path: str) -> bool:
+    try:
+        return os.path.samestat(os.fstat(f.fileno()), os.stat(path))
+    except FileNotFoundError:
+        return False
+
+
+def resolve_chunks_path(jsonl_path: str) -> str:
+    """Prefer the JSONL artifact; fall back to the legacy tagged_chunks.json beside it."""
+    if os.path.exists(jsonl_path) or os.path.exists(jsonl_path + IN_PROGRESS_SUFFIX):
+        return jsonl_path
+    legacy = jsonl_path[:-len(".jsonl")] + ".json" if jsonl_path.endswith(".jsonl") else jsonl_path
+    return legacy if os.path.exists(legacy) else jsonl_path
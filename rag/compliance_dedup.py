@@ -0,0 +1,152 @@
+# rag/compliance_dedup.py — consolidates near-duplicate compliance requirements into a compact matrix
+
+import hashlib
+import json
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+# Requirements whose word-shingle Jaccard reaches this are treated as the same requirement
+DEDUP_JACCARD = float(os.getenv("COMPLIANCE_DEDUP_JACCARD", "0.6"))
+SHINGLE_WORDS = 3
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4  # 4 bands × 16 bits: fingerprints within Hamming distance 3 always share a band
+
+CATEGORY_PREFIX = {"proposal_response": "PR", "project_performance": "PP"}
+
+
+def normalize_requirement(text: str) -> str:
+    text = re.sub(r"[^\w\s]", " ", (text or "").lower())
+    return " ".join(text.split())
+
+
+def shingles(normalized: str) -> frozenset:
+    words = normalized.split()
+    if len(words) < SHINGLE_WORDS:
+        return frozenset([normalized])
+    return frozenset(" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1))
+
+
+def simhash(features: frozenset) -> int:
+    weights = [0] * SIMHASH_BITS
+    for feature in features:
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    return sum(1 << bit for bit, w in enumerate(weights) if w > 0)
+
+
+def _band_keys(fingerprint: int) -> List[tuple]:
+    width = SIMHASH_BITS // SIMHASH_BANDS
+    mask = (1 << width) - 1
+    return [(band, (fingerprint >> (band * width)) & mask) for band in range(SIMHASH_BANDS)]
+
+
+def cluster_requirements(rows: List[Dict], threshold: float = DEDUP_JACCARD) -> List[List[int]]:
+    """
+    Group row indices whose requirement text is a near-duplicate. Exact normalized matches and
+    shingle-overlap candidates (shared shingle or SimHash band) are verified with Jaccard >= threshold.
+    """
+    normalized = [normalize_requirement(r.get("requirement", "")) for r in rows]
+    shingle_sets = [shingles(n) for n in normalized]
+    parent = list(range(len(rows)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        parent[find(i)] = find(j)
+
+    first_by_text = {}
+    buckets = defaultdict(list)
+    for i, (text, features) in enumerate(zip(normalized, shingle_sets)):
+        if text in first_by_text:
+            union(i, first_by_text[text])
+            continue
+        first_by_text[text] = i
+
+        candidates = set()
+        for key in _band_keys(simhash(features)):
+            candidates.update(buckets[key])
+            buckets[key].append(i)
+        # Window overlap re-extracts the same sentence, so a shared shingle is the common case
+        for feature in features:
+            candidates.update(buckets[("shingle", feature)])
+            buckets[("shingle", feature)].append(i)
+
+        for j in candidates:
+            if find(i) == find(j):
+                continue
+            shared = len(features & shingle_sets[j])
+            if shared and shared >= threshold * (len(features) + len(shingle_sets[j]) - shared):
+                union(i, j)
+
+    clusters = defaultdict(list)
+    for i in range(len(rows)):
+        clusters[find(i)].append(i)
+    return sorted(clusters.values(), key=lambda members: members[0])
+
+
+def _unique(values) -> List:
+    return list(dict.fromkeys(v for v in values if v))
+
+
+def consolidate(rows: List[Dict], category: str, threshold: float = DEDUP_JACCARD) -> List[Dict]:
+    """One matrix row per cluster: the most complete wording, with every source and chunk_id it came from."""
+    consolidated = []
+    for n, members in enumerate(cluster_requirements(rows, threshold), start=1):
+        group = [rows[i] for i in members]
+        representative = max(group, key=lambda r: len(r.get("requirement") or ""))
+        types = Counter(r.get("type") for r in group if r.get("type"))
+        consolidated.append({
+            "id": f"{CATEGORY_PREFIX.get(category, 'RQ')}-{n:03d}",
+            "category": category,
+            "type": types.most_common(1)[0][0] if types else None,
+            "requirement": representative.get("requirement"),
+            "sources": _unique(r.get("source") for r in group),
+            "chunk_ids": _unique(r.get("chunk_id") for r in group),
+            "occurrences": len(group),
+        })
+    return consolidated
+
+
+def build_compliance_matrix(compliance_response: List[Dict], compliance_performance: List[Dict],
+                            threshold: float = DEDUP_JACCARD) -> Dict:
+    requirements = (consolidate(compliance_response, "proposal_response", threshold)
+                    + consolidate(compliance_performance, "project_performance", threshold))
+    rows_in = len(compliance_response) + len(compliance_performance)
+    print(f"🧹 Consolidated {rows_in} compliance rows into {len(requirements)} requirements")
+    return {
+        "summary": {
+            "rows_in": rows_in,
+            "rows_out": len(requirements),
+            "proposal_response": sum(1 for r in requirements if r["category"] == "proposal_response"),
+            "project_performance": sum(1 for r in requirements if r["category"] == "project_performance"),
+        },
+        "requirements": requirements,
+    }
+
+
+def save_compliance_matrix(matrix: Dict, output_path: str):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(matrix, f, indent=2)
+    print(f"✅ Saved compliance matrix to: {output_path}")
+
+
+if __name__ == "__main__":
+    import sys
+    portfolio = sys.argv[1]
+    opportunity = sys.argv[2]
+    base = f"data/{portfolio}/opportunities/{opportunity}"
+
+    with open(f"{base}/compliance_response.json", "r", encoding="utf-8") as f:
+        response_rows = json.load(f)
+    with open(f"{base}/compliance_performance.json", "r", encoding="utf-8") as f:
+        performance_rows = json.load(f)
+
+    save_compliance_matrix(build_compliance_matrix(response_rows, performance_rows), f"{base}/compliance_matrix.json")
@@ -1,21 +1,74 @@
 # rag/compliance_tagger.py — Extracts compliance requirements
 
 import json
-import time
+import os
+import re
+import threading
 from pathlib import Path
-from rag.llm_client_claude import invoke_claude
-
-def tag_compliance_chunks(chunks):
-    response_compliance = []
-    performance_compliance = []
+from rag.llm_client_claude import invoke_routed
+from rag.llm_pool import iter_in_pool
+
+# === Requirement prefilter ===
+# Send every character to Claude instead of only requirement-bearing sentences (COMPLIANCE_FULL_SCAN=1)
+COMPLIANCE_FULL_SCAN = os.getenv("COMPLIANCE_FULL_SCAN", "0") == "1"
+# Neighbouring sentences kept on each side of a matching sentence
+CONTEXT_SENTENCES = int(os.getenv("COMPLIANCE_CONTEXT_SENTENCES", "1"))
+
+REQUIREMENT_REGEX = re.compile(
+    r"\b(shall|must|will|required?|requirements?|mandatory|is responsible for|are responsible for"
+    r"|not (?:to )?exceed|no (?:more|later) than|at (?:least|a minimum)|limit(?:ed|s)?|\d+[- ]pages?"
+    r"|font|margins?|due (?:date|by|on)|deadline|submit(?:ted|tal)?|deliver(?:able|ed|y)?s?"
+    r"|(?:FAR|DFARS|HSAR|GSAM)\s*(?:clause\s*)?\d{1,2}\.\d{3}(?:-\d+)?|\d{2}\.\d{3}-\d+)\b",
+    re.IGNORECASE,
+)
+# A sentence ends at terminal punctuation followed by whitespace (so not inside "52.212-4") or at a line break
+SENTENCE_REGEX = re.compile(r"[^\n]+?(?:[.!?]+(?=\s|$)|(?=\n)|$)")
+
+
+def find_requirement_spans(text, context_sentences=CONTEXT_SENTENCES):
+    """(start, end) spans of sentences with normative language, widened by neighbouring sentences and merged."""
+    sentences = [(m.start(), m.end()) for m in SENTENCE_REGEX.finditer(text) if m.group().strip()]
+    hits = [i for i, (start, end) in enumerate(sentences) if REQUIREMENT_REGEX.search(text, start, end)]
+
+    spans = []
+    for i in hits:
+        start = sentences[max(0, i - context_sentences)][0]
+        end = sentences[min(len(sentences) - 1, i + context_sentences)][1]
+        if spans and start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], end))
+        else:
+            spans.append((start, end))
+    return spans
+
+
+def prefilter_requirements(text, context_sentences=CONTEXT_SENTENCES):
+    """The requirement-bearing parts of `text`, with gaps marked by an ellipsis line."""
+    return "\n...\n".join(text[start:end].strip() for start, end in find_requirement_spans(text, context_sentences))
+
+
+def tag_compliance_chunks(chunks, max_in_flight=None, on_tagged=None, full_scan=None):
     MAX_CHARS = 3000
     OVERLAP = 200
-
-    for i, chunk in enumerate(chunks):
+    full_scan = COMPLIANCE_FULL_SCAN if full_scan is None else full_scan
+    stats = {"chars_total": 0, "chars_sent": 0, "chunks_skipped": 0}
+    stats_lock = threading.Lock()
+
+    def tag_one(chunk):
+        response_compliance = []
+        performance_compliance = []
+        failed = False
         chunk_text = chunk.get("text", "")
         chunk_id = chunk.get("chunk_id")
         source = chunk.get("metadata", {}).get("source_document", "unknown")
 
+        total_chars = len(chunk_text)
+        if not full_scan:
+            chunk_text = prefilter_requirements(chunk_text)
+        with stats_lock:
+            stats["chars_total"] += total_chars
+            stats["chars_sent"] += len(chunk_text)
+            stats["chunks_skipped"] += 0 if chunk_text else 1
+
         start = 0
         while start < len(chunk_text):
             end = min(start + MAX_CHARS, len(chunk_text))
@@ -49,9 +102,8 @@ Only return valid JSON.
 
             try:
                 print(f"⏳ [compliance_tagger] Sending chunk {chunk_id} to Claude...")
-                result_text = invoke_claude(prompt)
+                parsed = invoke_routed("compliance_extraction", prompt, expect_json=True)
                 print("✅ Response received")
-                parsed = json.loads(result_text[result_text.find("{"):])
 
                 for item in parsed.get("proposal_response", []):
                     item["source"] = source
@@ -65,12 +117,35 @@ Only return valid JSON.
 
             except Exception as e:
                 print(f"⚠️ Error parsing compliance from chunk {chunk_id}: {e}")
+                failed = True
                 break
 
             if end == len(chunk_text):
                 break
             start = end - OVERLAP if end - OVERLAP > start else end
-            time.sleep(0.5 if i % 2 == 0 else 1.0)
+
+        if on_tagged and not failed:
+            on_tagged(chunk_id, {"proposal_response": response_compliance,
+                                 "project_performance": performance_compliance})
+        return response_compliance, performance_compliance
+
+    # Sub-chunks of one chunk stay sequential; chunks run concurrently and are re-joined in order
+    response_compliance = []
+    performance_compliance = []
+    for result in iter_in_pool(tag_one, chunks, max_in_flight=max_in_flight):
+        if isinstance(result, Exception):
+            print(f"⚠️ Compliance tagging failed for a chunk: {result}")
+            continue
+        response_items, performance_items = result
+        response_compliance.extend(response_items)
+        performance_compliance.extend(performance_items)
+
+    if stats["chars_total"]:
+        skipped = 1 - stats["chars_sent"] / stats["chars_total"]
+        mode = "full scan" if full_scan else "prefiltered"
+        print(f"🔎 [compliance_tagger] {mode}: skipped {skipped:.0%} of text "
+              f"({stats['chars_sent']:,}/{stats['chars_total']:,} chars sent, "
+              f"{stats['chunks_skipped']} chunks with no requirement language)")
 
     return response_compliance, performance_compliance
 
@@ -78,13 +153,15 @@ if __name__ == "__main__":
     import sys
     portfolio = sys.argv[1]
     opportunity = sys.argv[2]
+    from rag.chunk_store import iter_chunks, resolve_chunks_path
+    from rag.project_paths import get_tagged_chunks_jsonl_path
+
     base = f"data/{portfolio}/opportunities/{opportunity}"
-    chunk_path = f"{base}/tagged_chunks.json"
+    chunk_path = resolve_chunks_path(get_tagged_chunks_jsonl_path(portfolio, opportunity))
     out_response = f"{base}/compliance_response.json"
     out_performance = f"{base}/compliance_performance.json"
 
-    with open(chunk_path, "r", encoding="utf-8") as f:
-        chunks = json.load(f)
+    chunks = iter_chunks(chunk_path, follow=True)
 
     print(f"📂 Running compliance tagger for {portfolio}/{opportunity}...")
     r_comp, p_comp = tag_compliance_chunks(chunks)
@@ -8,7 +8,7 @@ from pathlib import Path
 from dotenv import load_dotenv
 
 from rag.project_paths import get_past_perf_json_path, get_s3_prefix
-from rag.pipeline_utils import list_s3_files, download_s3_file, list_local_files, load_documents
+from rag.pipeline_utils import sync_s3_prefix, list_local_files, load_documents
 from rag.past_perf_utils import extract_project_metadata, infer_project_name, merge_projects
 
 load_dotenv(dotenv_path=".env.local")
@@ -22,11 +22,7 @@ def run_past_perf_extraction(portfolio: str, opportunity: str):
 
     # Download files from S3 (if present)
     pp_s3_prefix = get_s3_prefix(portfolio, opportunity, subfolder="past_performance")
-    pp_keys = list_s3_files(bucket, prefix=pp_s3_prefix)
-    for key in pp_keys:
-        filename = key.split("/")[-1]
-        dest_path = os.path.join(pp_folder, filename)
-        download_s3_file(bucket, key, dest_path)
+    sync_s3_prefix(bucket, pp_s3_prefix, pp_folder)
 
     # Load documents
     docs = load_documents(list_local_files(pp_folder))
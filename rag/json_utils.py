@@ -0,0 +1,146 @@
+# rag/json_utils.py — shared extraction and local repair of JSON embedded in Claude responses
+
+import json
+import re
+
+CLOSERS = {"{": "}", "[": "]"}
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+TRAILING_COMMA_REGEX = re.compile(r",(\s*[}\]])")
+# A truncated object can end on a key with no value yet, and any container on a dangling comma
+DANGLING_KEY_REGEX = re.compile(r'([{,])\s*"(?:[^"\\]|\\.)*"\s*:?\s*$')
+DANGLING_COMMA_REGEX = re.compile(r",\s*$")
+
+
+class JsonExtractionError(ValueError):
+    """No usable JSON value in a response; `truncated` is set when the value was cut off mid-way."""
+
+    def __init__(self, message: str, truncated: bool = False):
+        super().__init__(message)
+        self.truncated = truncated
+
+
+def scan_json(text: str, start: int = 0, openers: str = "{"):
+    """
+    Find the first JSON value opening with one of `openers` at or after `start`, tracking strings and
+    escapes so braces inside values don't count. Returns (start, end, open_stack); a non-empty stack
+    means the value runs off the end of the text. Returns None when nothing opens.
+    """
+    starts = [i for i in (text.find(opener, start) for opener in openers) if i >= 0]
+    if not starts:
+        return None
+    begin = min(starts)
+    stack = []
+    in_string = escaped = False
+    for i in range(begin, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in CLOSERS:
+            stack.append(ch)
+        elif ch in "}]":
+            if stack and CLOSERS[stack[-1]] == ch:
+                stack.pop()
+            if not stack:
+                return begin, i + 1, []
+    if in_string:
+        stack.append('"')
+    return begin, len(text), stack
+
+
+def is_truncated(text: str, openers: str = "{") -> bool:
+    """True when the response opens a JSON value that never closes (e.g. cut off at max_tokens)."""
+    span = scan_json(text, openers=openers)
+    return span is not None and bool(span[2])
+
+
+def _repair_outside_strings(fragment: str) -> str:
+    # Rewrite only the parts between string literals so values like "None of the above" survive
+    parts = re.split(r'("(?:[^"\\]|\\.)*")', fragment)
+    for i in range(0, len(parts), 2):
+        segment = TRAILING_COMMA_REGEX.sub(r"\1", parts[i])
+        parts[i] = re.sub(r"\b(True|False|None)\b", lambda m: PYTHON_LITERALS[m.group(1)], segment)
+    return "".join(parts)
+
+
+def _escape_raw_newlines(fragment: str) -> str:
+    return re.sub(r'"(?:[^"\\]|\\.)*"', lambda m: m.group().replace("\n", "\\n").replace("\t", "\\t"),
+                  fragment, flags=re.DOTALL)
+
+
+def _open_string_start(fragment: str) -> int:
+    """Index of the quote opening the string that is still unterminated at the end of `fragment`."""
+    start = -1
+    in_string = escaped = False
+    for i, ch in enumerate(fragment):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+            start = i
+    return start
+
+
+def close_truncated(fragment: str, stack) -> str:
+    """Close every open bracket, dropping a trailing half-written member (including a cut-off string)."""
+    if stack and stack[-1] == '"':
+        # The string may have lost any part of its text, so the member it belongs to is dropped
+        fragment = fragment[:_open_string_start(fragment)]
+        stack = stack[:-1]
+    if stack and stack[-1] == "{":
+        fragment = DANGLING_KEY_REGEX.sub(r"\1", fragment)
+    fragment = DANGLING_COMMA_REGEX.sub("", fragment.rstrip())
+    return fragment + "".join(CLOSERS[opener] for opener in reversed(stack))
+
+
+def repair_json(fragment: str) -> str:
+    """Local fixes for the defects Claude commonly produces: trailing commas, Python literals, raw newlines in strings."""
+    return _repair_outside_strings(_escape_raw_newlines(fragment))
+
+
+def parse_json_response(text: str, allow_truncated: bool = True, openers: str = "{"):
+    """
+    Parse the first balanced JSON object (or array, with openers="{[") in a response, ignoring
+    surrounding prose, code fences and brace-delimited text that isn't JSON.
+    Falls back to local repair, and (when allowed) closes a truncated value so the complete
+    members are kept. Raises JsonExtractionError when nothing usable is found.
+    """
+    if not text:
+        raise JsonExtractionError("Empty response")
+    start = 0
+    error = JsonExtractionError("No JSON value in response")
+    while True:
+        span = scan_json(text, start, openers=openers)
+        if span is None:
+            raise error
+        begin, end, stack = span
+        fragment = text[begin:end]
+
+        if not stack:
+            try:
+                return json.loads(fragment)
+            except json.JSONDecodeError:
+                pass
+        elif not allow_truncated:
+            raise JsonExtractionError("JSON response was truncated", truncated=True)
+        else:
+            fragment = close_truncated(fragment, stack)
+
+        try:
+            return json.loads(repair_json(fragment))
+        except json.JSONDecodeError as e:
+            error = JsonExtractionError(f"Unrepairable JSON in response: {e}", truncated=bool(stack))
+        # Not JSON after all (e.g. "{braces}" in prose): try the next candidate. An unclosed one runs to
+        # the end of the text, so the search resumes just inside it rather than after it.
+        start = end if not stack else begin + 1
@@ -1,11 +1,15 @@
 # rag/keyword_theme_analyzer.py — Hybrid strategy with batching
 
 import json
-import re
+import os
 import string
-from collections import Counter, defaultdict
+import heapq
+import multiprocessing
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from itertools import islice
-from rag.llm_client_claude import invoke_claude
+from rag.llm_client_claude import invoke_claude, complete_truncated_json
+from rag.json_utils import JsonExtractionError, parse_json_response
 from difflib import SequenceMatcher
 
 STOPWORDS = set("""
@@ -13,73 +17,184 @@ a an and are as at be but by for if in into is it no not of on or such that the
 """.split())
 
 
-def extract_terms(text, max_vocab=500):
-    text = text.lower()
-    text = text.translate(str.maketrans('', '', string.punctuation))
-    words = text.split()
-    unigrams = [w for w in words if w not in STOPWORDS and len(w) > 2]
+PUNCT_TABLE = str.maketrans('', '', string.punctuation)
+# Worker processes for n-gram counting (1 = count in-process)
+KEYWORD_WORKERS = int(os.getenv("KEYWORD_WORKERS", "1"))
+TEXTS_PER_TASK = 256
+
+
+def _count_texts(texts):
+    """
+    Count unigrams, bigrams and trigrams over each text with a rolling window of term IDs.
+    N-grams never span two texts, so the totals don't depend on how texts are grouped.
+    """
+    vocab = {}
+    words_by_id = []
+    unigrams = Counter()
+    bigrams = Counter()
+    trigrams = Counter()
+
+    for text in texts:
+        prev1 = prev2 = None
+        for word in text.lower().translate(PUNCT_TABLE).split():
+            if word in STOPWORDS:
+                # No n-gram may contain a stopword, so the window restarts after one
+                prev1 = prev2 = None
+                continue
+            term_id = vocab.get(word)
+            if term_id is None:
+                term_id = vocab[word] = len(words_by_id)
+                words_by_id.append(word)
+            if len(word) > 2:
+                unigrams[term_id] += 1
+            if prev1 is not None:
+                bigrams[(prev1, term_id)] += 1
+                if prev2 is not None:
+                    trigrams[(prev2, prev1, term_id)] += 1
+            prev2, prev1 = prev1, term_id
+
+    counter = Counter()
+    for term_id, n in unigrams.items():
+        counter[words_by_id[term_id]] += n
+    for (a, b), n in bigrams.items():
+        counter[f"{words_by_id[a]} {words_by_id[b]}"] += n
+    for (a, b, c), n in trigrams.items():
+        counter[f"{words_by_id[a]} {words_by_id[b]} {words_by_id[c]}"] += n
+    return counter
 
-    bigrams = [f"{w1} {w2}" for w1, w2 in zip(words, words[1:]) if w1 not in STOPWORDS and w2 not in STOPWORDS]
-    trigrams = [f"{w1} {w2} {w3}" for w1, w2, w3 in zip(words, words[1:], words[2:]) if all(w not in STOPWORDS for w in (w1, w2, w3))]
 
-    counter = Counter(unigrams + bigrams + trigrams)
-    return counter
+def count_terms(texts, workers=None):
+    """
+    Stream texts (e.g. chunk["text"] from a generator) into one term Counter.
+    With workers > 1, groups of texts are counted in separate processes and the Counters merged.
+    """
+    workers = workers or KEYWORD_WORKERS
+    texts = iter(texts)
+    if workers <= 1:
+        return _count_texts(texts)
 
+    term_counter = Counter()
+    # Spawned, not forked: this runs beside other stages' threads, which may hold locks at fork time
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        window = deque()
+        while True:
+            batch = list(islice(texts, TEXTS_PER_TASK))
+            if batch:
+                window.append(executor.submit(_count_texts, batch))
+            if window and (len(window) >= workers * 2 or not batch):
+                term_counter.update(window.popleft().result())
+            if not batch and not window:
+                break
+    return term_counter
 
-def clean_malformed_json(text):
-    text = re.sub(r",\s*([}\]])", r"\1", text)
-    return text
 
+def top_terms_by_frequency(term_counter, n):
+    # Ties broken alphabetically so the shortlist is the same however the counts were merged
+    return heapq.nsmallest(n, term_counter.items(), key=lambda kv: (-kv[1], kv[0]))
 
-def merge_similar_themes(themes, similarity_threshold=0.75):
-    merged = []
-    used = set()
 
-    def similar(a, b):
-        return SequenceMatcher(None, a.lower(), b.lower()).ratio() >= similarity_threshold
+def extract_terms(text, max_vocab=500):
+    return _count_texts([text])
+
+
+# Candidate pairs must overlap this much on name trigrams before SequenceMatcher is consulted
+THEME_BLOCKING_JACCARD = 0.3
+# A name this short has too few trigrams to block on (and can only reach the threshold against
+# names of similar length), so short names are compared with every short representative
+SHORT_NAME_LENGTH = 3
+
+
+def _name_shingles(name):
+    normalized = " ".join(name.lower().translate(PUNCT_TABLE).split())
+    if len(normalized) < 3:
+        return normalized, frozenset([normalized])
+    return normalized, frozenset(normalized[i:i + 3] for i in range(len(normalized) - 2))
+
+
+def _keyword_term(keyword):
+    # Keywords arrive as plain strings from Claude, or as {"term", "frequency"} once scored
+    return keyword.get("term") if isinstance(keyword, dict) else keyword
+
+
+def merge_similar_themes(themes, term_counter=None, similarity_threshold=0.75):
+    """
+    Greedily cluster themes around representatives: in input order, each distinct name joins the
+    earliest representative it is similar to (SequenceMatcher ratio >= threshold), or becomes one.
+    Names are only compared with representatives, so a match never pulls in names the representative
+    doesn't match. Candidates come from rare shared name trigrams (prefix filtering over an inverted
+    index of representatives); names of up to SHORT_NAME_LENGTH characters are compared directly.
+    """
+    term_counter = term_counter or {}
+
+    # Unique normalized names; every theme points at its name's slot
+    slot_by_name = {}
+    names = []
+    shingle_sets = []
+    theme_slots = []
+    for theme in themes:
+        normalized, shingles = _name_shingles(theme.get("theme", ""))
+        if normalized not in slot_by_name:
+            slot_by_name[normalized] = len(names)
+            names.append(normalized)
+            shingle_sets.append(shingles)
+        theme_slots.append(slot_by_name[normalized])
+
+    # Rarest shingles first: sets with Jaccard >= t must share one of each set's first |s| - ceil(t·|s|) + 1
+    document_frequency = Counter(sh for shingles in shingle_sets for sh in shingles)
+    index = defaultdict(list)
+    short_representatives = []
+    representative_of = list(range(len(names)))
+    for i, shingles in enumerate(shingle_sets):
+        ordered = sorted(shingles, key=lambda sh: (document_frequency[sh], sh))
+        prefix = ordered[:len(ordered) - int(THEME_BLOCKING_JACCARD * len(ordered)) + 1]
+        candidates = set()
+        for sh in prefix:
+            candidates.update(index[sh])
+        if len(names[i]) <= SHORT_NAME_LENGTH:
+            candidates.update(short_representatives)
+        # The name is sequence b, whose index SequenceMatcher builds once and reuses for every candidate
+        matcher = SequenceMatcher(None, "", names[i])
+        for j in sorted(candidates):
+            if len(names[j]) > SHORT_NAME_LENGTH or len(names[i]) > SHORT_NAME_LENGTH:
+                shared = len(shingles & shingle_sets[j])
+                if shared < THEME_BLOCKING_JACCARD * (len(shingles) + len(shingle_sets[j]) - shared):
+                    continue
+            matcher.set_seq1(names[j])
+            if (matcher.real_quick_ratio() >= similarity_threshold
+                    and matcher.quick_ratio() >= similarity_threshold
+                    and matcher.ratio() >= similarity_threshold):
+                representative_of[i] = j
+                break
+        else:
+            for sh in prefix:
+                index[sh].append(i)
+            if len(names[i]) <= SHORT_NAME_LENGTH:
+                short_representatives.append(i)
 
-    for i, base in enumerate(themes):
-        if i in used:
-            continue
-        base_keywords = set(base["keywords"])
-        new_theme = base["theme"]
+    clusters = defaultdict(list)
+    for theme_index, slot in enumerate(theme_slots):
+        clusters[representative_of[slot]].append(theme_index)
 
-        for j, candidate in enumerate(themes[i + 1:], start=i + 1):
-            if j in used:
-                continue
-            if similar(base["theme"], candidate["theme"]):
-                base_keywords.update(candidate["keywords"])
-                used.add(j)
+    merged = []
+    for members in sorted(clusters.values(), key=lambda m: m[0]):
+        keywords = set()
+        for i in members:
+            keywords.update(t for t in map(_keyword_term, themes[i].get("keywords", [])) if t)
         merged.append({
-            "theme": new_theme,
+            "theme": themes[members[0]]["theme"],
             "keywords": sorted([
-                {"term": k, "frequency": term_counter.get(k, 0)} for k in base_keywords
-            ], key=lambda x: x["frequency"], reverse=True)
+                {"term": k, "frequency": term_counter.get(k, 0)} for k in keywords
+            ], key=lambda x: (-x["frequency"], x["term"]))
         })
     return merged
 
 
 def analyze_keywords_from_chunks(chunks, portfolio=None, opportunity=None):
-    print("\n🔍 [keyword_theme_analyzer] Extracting frequent terms in batches...")
-
-    MAX_CHARS_PER_BATCH = 100_000
-    current_text = ""
-    term_counter = Counter()
+    print("\n🔍 [keyword_theme_analyzer] Counting frequent terms across chunks...")
 
-    for chunk in chunks:
-        text = chunk.get("text", "")
-        if len(current_text) + len(text) > MAX_CHARS_PER_BATCH:
-            counter = extract_terms(current_text)
-            term_counter.update(counter)
-            current_text = text
-        else:
-            current_text += "\n\n" + text
-
-    if current_text:
-        counter = extract_terms(current_text)
-        term_counter.update(counter)
+    term_counter = count_terms(chunk.get("text", "") for chunk in chunks)
 
-    top_terms = term_counter.most_common(250)
+    top_terms = top_terms_by_frequency(term_counter, 250)
     with open("keyword_frequencies.json", "w", encoding="utf-8") as freq_file:
         json.dump(dict(top_terms), freq_file, indent=2)
     print(f"📊 Saved term frequencies to: keyword_frequencies.json")
@@ -109,7 +224,7 @@ Only return valid JSON:
 
     try:
         print("⏳ Sending terms to Claude...")
-        result = invoke_claude(prompt)
+        result = complete_truncated_json(prompt, invoke_claude(prompt))
         with open("keyword_themes_response.txt", "w", encoding="utf-8") as rf:
             rf.write(result)
         print("✅ Response received")
@@ -117,11 +232,8 @@ Only return valid JSON:
         with open("keyword_themes_raw.json", "w", encoding="utf-8") as raw_file:
             raw_file.write(result)
 
-        start = result.find('{')
-        end = result.rfind('}') + 1
-        cleaned = clean_malformed_json(result[start:end])
         try:
-            parsed = json.loads(cleaned)
+            parsed = parse_json_response(result)
             parsed["frequencies"] = dict(term_counter)
 
             if "themes" in parsed:
@@ -135,12 +247,10 @@ Only return valid JSON:
                     theme_obj["keywords"] = sorted([
                         {"term": k, "frequency": term_counter.get(k, 0)} for k in cleaned_keywords
                     ], key=lambda x: x["frequency"], reverse=True)
-                parsed["themes"] = merge_similar_themes(parsed["themes"])
-        except json.JSONDecodeError as e:
-            with open(f"data/{portfolio}/opportunities/{opportunity}/keyword_themes_cleaned.json", "w", encoding="utf-8") as cf:
-                cf.write(cleaned)
-            print(f"⚠️ Cleaned JSON also failed: {e}")
-            return {"error": "Failed to parse cleaned JSON", "details": str(e)}
+                parsed["themes"] = merge_similar_themes(parsed["themes"], term_counter)
+        except JsonExtractionError as e:
+            print(f"⚠️ Repaired JSON also failed: {e}")
+            return {"error": "Failed to parse theme JSON", "details": str(e)}
         print("✅ Keyword theme analysis complete")
         return parsed
     except Exception as e:
@@ -152,13 +262,14 @@ if __name__ == "__main__":
     import sys
     portfolio = sys.argv[1]
     opportunity = sys.argv[2]
-    chunk_path = f"data/{portfolio}/opportunities/{opportunity}/tagged_chunks.json"
-    output_path = f"data/{portfolio}/opportunities/{opportunity}/keyword_themes.json"
+    from rag.chunk_store import iter_chunks, resolve_chunks_path
+    from rag.project_paths import get_tagged_chunks_jsonl_path
 
-    with open(chunk_path, "r", encoding="utf-8") as f:
-        chunks = json.load(f)
+    chunk_path = resolve_chunks_path(get_tagged_chunks_jsonl_path(portfolio, opportunity))
+    output_path = f"data/{portfolio}/opportunities/{opportunity}/keyword_themes.json"
 
-    result = analyze_keywords_from_chunks(chunks, portfolio, opportunity)
+    # Streams chunks, following the artifact while the orchestrator is still writing it
+    result = analyze_keywords_from_chunks(iter_chunks(chunk_path, follow=True), portfolio, opportunity)
     with open(output_path, "w", encoding="utf-8") as f:
         json.dump(result, f, indent=2)
 
@@ -2,36 +2,476 @@
 
 import os
 import json
+import time
+import sqlite3
+import hashlib
+import random
+import threading
 import boto3
 import botocore
 from dotenv import load_dotenv
 
+from rag import json_utils, metrics
+from rag.rate_control import RETRYABLE_EXCEPTIONS, call_with_rate_control, error_code, is_throttle
+
 load_dotenv(dotenv_path=".env.local")
 
-bedrock_runtime = boto3.client(
-    service_name="bedrock-runtime",
-    region_name=os.getenv("BEDROCK_REGION"),
-    aws_access_key_id=os.getenv("BEDROCK_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("BEDROCK_SECRET_ACCESS_KEY"),
-    config=botocore.client.Config(connect_timeout=10, read_timeout=60)
-)
+# Point at a local stand-in such as rag/bedrock_stub.py (e.g. http://127.0.0.1:8787) for offline load tests
+BEDROCK_ENDPOINT_URL = os.getenv("BEDROCK_ENDPOINT_URL") or None
+# Keep-alive connections to Bedrock; should cover the highest LLM_MAX_IN_FLIGHT in use
+BEDROCK_MAX_CONNECTIONS = int(os.getenv("BEDROCK_MAX_CONNECTIONS", "64"))
+
+
+def _make_bedrock_client(endpoint_url: str = None, read_timeout: int = 60):
+    # A stub endpoint needs no real credentials, but botocore still signs requests
+    return boto3.client(
+        service_name="bedrock-runtime",
+        region_name=os.getenv("BEDROCK_REGION") or ("us-east-1" if endpoint_url else None),
+        aws_access_key_id=os.getenv("BEDROCK_ACCESS_KEY_ID") or ("stub" if endpoint_url else None),
+        aws_secret_access_key=os.getenv("BEDROCK_SECRET_ACCESS_KEY") or ("stub" if endpoint_url else None),
+        endpoint_url=endpoint_url,
+        # Retries are handled by rag.rate_control so throttling feeds the AIMD limiter instead of hiding in botocore
+        config=botocore.client.Config(connect_timeout=10, read_timeout=read_timeout, max_pool_connections=BEDROCK_MAX_CONNECTIONS,
+                                      retries={"max_attempts": 1, "mode": "standard"})
+    )
+
+
+bedrock_runtime = _make_bedrock_client(BEDROCK_ENDPOINT_URL)
+# Clients for model tiers with a non-default read timeout, built on first use
+_timeout_clients = {}
+_timeout_clients_lock = threading.Lock()
+
+
+def set_bedrock_endpoint(endpoint_url: str = None):
+    """Rebuild the Bedrock client against another endpoint (None = the real AWS endpoint)."""
+    global bedrock_runtime, BEDROCK_ENDPOINT_URL
+    BEDROCK_ENDPOINT_URL = endpoint_url
+    bedrock_runtime = _make_bedrock_client(endpoint_url)
+    with _timeout_clients_lock:
+        _timeout_clients.clear()
+
+
+def _client_for(timeout: int = None):
+    if not timeout or timeout == 60:
+        return bedrock_runtime
+    with _timeout_clients_lock:
+        if timeout not in _timeout_clients:
+            _timeout_clients[timeout] = _make_bedrock_client(BEDROCK_ENDPOINT_URL, read_timeout=timeout)
+        return _timeout_clients[timeout]
+
 
 MODEL_ID = "anthropic.claude-3-sonnet-20240229-v1:0"
 
-def invoke_claude(prompt: str, temperature: float = 0.0, max_tokens: int = 1000) -> str:
+# USD per million (input, output) tokens, for the cost figures in the run report
+MODEL_PRICES_PER_MTOK = {
+    "anthropic.claude-3-sonnet-20240229-v1:0": (3.00, 15.00),
+    "anthropic.claude-3-haiku-20240307-v1:0": (0.25, 1.25),
+    "anthropic.claude-3-5-sonnet-20240620-v1:0": (3.00, 15.00),
+}
+
+# === Response cache (SQLite, keyed by hash of model + params + prompt) ===
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_responses.sqlite")
+CACHE_ENABLED = os.getenv("LLM_CACHE_DISABLE", "").lower() not in ("1", "true", "yes")
+CACHE_MAX_AGE_DAYS = float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "200000"))
+
+_cache_lock = threading.Lock()
+_cache_conn = None
+_cache_stats = {"hits": 0, "misses": 0, "writes": 0}
+
+
+def set_cache_enabled(enabled: bool):
+    """Turn the response cache on or off for this process (e.g. from a --no-llm-cache flag)."""
+    global CACHE_ENABLED
+    CACHE_ENABLED = enabled
+
+
+def cache_key(prompt: str, temperature: float, max_tokens: int, model_id: str = None, prefill: str = "") -> str:
+    parts = [model_id or MODEL_ID, temperature, max_tokens, prompt]
+    if prefill:
+        # Continuations are keyed on their assistant prefill; plain calls keep their existing keys
+        parts.append(prefill)
+    payload = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _get_cache():
+    global _cache_conn
+    if _cache_conn is None:
+        cache_dir = os.path.dirname(CACHE_PATH)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        _cache_conn = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        _cache_conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, model_id TEXT, response TEXT,"
+            " created_at REAL, last_used REAL)"
+        )
+        _cache_conn.commit()
+        _evict(_cache_conn, CACHE_MAX_AGE_DAYS, CACHE_MAX_ENTRIES)
+    return _cache_conn
+
+
+def _evict(conn, max_age_days, max_entries) -> int:
+    removed = 0
+    if max_age_days:
+        cutoff = time.time() - max_age_days * 86400
+        removed += conn.execute("DELETE FROM responses WHERE last_used < ?", (cutoff,)).rowcount
+    if max_entries:
+        removed += conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            " SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (max_entries,)
+        ).rowcount
+    conn.commit()
+    return removed
+
+
+def evict_cache(max_age_days: float = None, max_entries: int = None) -> int:
+    """Drop entries not used within max_age_days and keep at most max_entries (LRU). Returns rows removed."""
+    with _cache_lock:
+        return _evict(_get_cache(), max_age_days, max_entries)
+
+
+def cache_get(key: str):
+    with _cache_lock:
+        conn = _get_cache()
+        row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            _cache_stats["misses"] += 1
+            return None
+        _cache_stats["hits"] += 1
+        conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        conn.commit()
+        return row[0]
+
+
+def cache_put(key: str, response: str, model_id: str = None):
+    now = time.time()
+    with _cache_lock:
+        conn = _get_cache()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, model_id, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, model_id or MODEL_ID, response, now, now)
+        )
+        conn.commit()
+        _cache_stats["writes"] += 1
+
+
+def cache_stats() -> dict:
+    with _cache_lock:
+        stats = dict(_cache_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return stats
+
+
+# === Record / replay (LLM_MODE=live|record|replay) ===
+# record: call Bedrock and append (prompt, params, response, latency) to LLM_RECORDINGS_PATH
+# replay: serve recorded responses without credentials; LLM_REPLAY_LATENCY=recorded|sample|none
+LLM_MODE = os.getenv("LLM_MODE", "live").lower()
+LLM_RECORDINGS_PATH = os.getenv("LLM_RECORDINGS_PATH", ".cache/llm_recordings.jsonl")
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "recorded").lower()
+
+_recording_lock = threading.Lock()
+_replay_index = None
+_replay_latencies = []
+
+
+class ReplayMissError(RuntimeError):
+    """Raised in replay mode when a prompt/params combination was never recorded."""
+
+
+def set_llm_mode(mode: str = None, recordings_path: str = None, replay_latency: str = None):
+    """Switch between live, record and replay for this process (e.g. from --llm-mode); None keeps the current value."""
+    global LLM_MODE, LLM_RECORDINGS_PATH, LLM_REPLAY_LATENCY, _replay_index
+    if mode is not None:
+        if mode not in ("live", "record", "replay"):
+            raise ValueError(f"Unknown LLM mode: {mode}")
+        LLM_MODE = mode
+    if recordings_path:
+        LLM_RECORDINGS_PATH = recordings_path
+    if replay_latency:
+        LLM_REPLAY_LATENCY = replay_latency
+    _replay_index = None
+
+
+def _record(key: str, prompt: str, temperature: float, max_tokens: int, text: str, usage: dict, latency_ms: float,
+            prefill: str = "", model_id: str = None):
+    entry = {
+        "key": key,
+        "model_id": model_id or MODEL_ID,
+        "params": {"temperature": temperature, "max_tokens": max_tokens},
+        "prompt": prompt,
+        "prefill": prefill,
+        "response": text,
+        "usage": usage,
+        "latency_ms": round(latency_ms, 1),
+        "recorded_at": time.time(),
+    }
+    line = json.dumps(entry, ensure_ascii=False)
+    with _recording_lock:
+        recordings_dir = os.path.dirname(LLM_RECORDINGS_PATH)
+        if recordings_dir:
+            os.makedirs(recordings_dir, exist_ok=True)
+        with open(LLM_RECORDINGS_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def _load_replay_index():
+    global _replay_index, _replay_latencies
+    with _recording_lock:
+        if _replay_index is not None:
+            return _replay_index
+        index = {}
+        latencies = []
+        with open(LLM_RECORDINGS_PATH, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                index.setdefault(entry["key"], entry)  # first recording wins, so replay is deterministic
+                latencies.append(entry.get("latency_ms", 0.0))
+        print(f"📼 Loaded {len(index)} recorded Claude responses from {LLM_RECORDINGS_PATH}")
+        _replay_latencies = sorted(latencies)
+        _replay_index = index
+        return index
+
+
+def _replay(key: str):
+    entry = _load_replay_index().get(key)
+    if entry is None:
+        raise ReplayMissError(f"No recorded response for key {key[:12]} in {LLM_RECORDINGS_PATH}")
+    if LLM_REPLAY_LATENCY == "recorded":
+        delay_ms = entry.get("latency_ms", 0.0)
+    elif LLM_REPLAY_LATENCY == "sample" and _replay_latencies:
+        # Same prompt => same draw, so a replayed run is repeatable while following the recorded distribution
+        delay_ms = random.Random(key).choice(_replay_latencies)
+    else:
+        delay_ms = 0.0
+    time.sleep(delay_ms / 1000.0)
+    return entry["response"], entry.get("usage") or {}
+
+
+def _invoke_bedrock(prompt: str, temperature: float, max_tokens: int, prefill: str = "",
+                    model_id: str = None, timeout: int = None):
+    messages = [{"role": "user", "content": prompt}]
+    if prefill:
+        messages.append({"role": "assistant", "content": prefill})
     body = {
         "anthropic_version": "bedrock-2023-05-31",
         "max_tokens": max_tokens,
         "temperature": temperature,
-        "messages": [{"role": "user", "content": prompt}]
+        "messages": messages
     }
 
-    response = bedrock_runtime.invoke_model(
-        modelId=MODEL_ID,
+    response = _client_for(timeout).invoke_model(
+        modelId=model_id or MODEL_ID,
         contentType="application/json",
         accept="application/json",
         body=json.dumps(body),
     )
 
     response_body = json.loads(response["body"].read())
-    return response_body["content"][0]["text"]
+    retries = response.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+    return response_body["content"][0]["text"], response_body.get("usage", {}), retries
+
+
+def _report_call(model_id: str, usage: dict, latency_s: float, retries: int = 0):
+    stage = metrics.current_stage.get()
+    input_tokens = usage.get("input_tokens", 0)
+    output_tokens = usage.get("output_tokens", 0)
+    input_price, output_price = MODEL_PRICES_PER_MTOK.get(model_id, (0.0, 0.0))
+    metrics.inc("llm_calls_total", model=model_id, stage=stage)
+    metrics.inc("llm_input_tokens_total", input_tokens, model=model_id, stage=stage)
+    metrics.inc("llm_output_tokens_total", output_tokens, model=model_id, stage=stage)
+    metrics.inc("llm_cost_usd_total", (input_tokens * input_price + output_tokens * output_price) / 1e6,
+                model=model_id, stage=stage)
+    metrics.inc("llm_seconds_total", latency_s, model=model_id, stage=stage)
+    if retries:
+        metrics.inc("llm_retries_total", retries, model=model_id, stage=stage)
+    metrics.observe("llm_latency_seconds", latency_s, model=model_id)
+
+
+def invoke_claude(prompt: str, temperature: float = 0.0, max_tokens: int = 1000, use_cache: bool = True,
+                  prefill: str = "", model_id: str = None, timeout: int = None) -> str:
+    """
+    Call Claude once (MODEL_ID unless `model_id` is given; `timeout` is the read timeout in seconds).
+    With `prefill`, the text is sent as the start of the assistant turn and the returned string is
+    only what Claude wrote after it.
+    """
+    model_id = model_id or MODEL_ID
+    key = cache_key(prompt, temperature, max_tokens, model_id=model_id, prefill=prefill)
+    started = time.perf_counter()
+    if LLM_MODE == "replay":
+        text, usage = _replay(key)
+        _report_call(model_id, usage, time.perf_counter() - started)
+        return text
+
+    # Record mode skips cache reads so every call made by the run ends up in the recording
+    use_cache = use_cache and CACHE_ENABLED
+    if use_cache and LLM_MODE != "record":
+        cached = cache_get(key)
+        if cached is not None:
+            metrics.inc("llm_cache_hits_total", model=model_id, stage=metrics.current_stage.get())
+            return cached
+
+    started = time.perf_counter()
+    try:
+        text, usage, retries = call_with_rate_control(
+            lambda: _invoke_bedrock(prompt, temperature, max_tokens, prefill, model_id, timeout), model_id=model_id)
+    except Exception as e:
+        metrics.inc("llm_errors_total", model=model_id, stage=metrics.current_stage.get(), error=type(e).__name__)
+        raise
+    latency_ms = (time.perf_counter() - started) * 1000
+    _report_call(model_id, usage, latency_ms / 1000, retries)
+
+    if LLM_MODE == "record":
+        _record(key, prompt, temperature, max_tokens, text, usage, latency_ms, prefill, model_id)
+    if use_cache:
+        cache_put(key, text, model_id)
+    return text
+
+
+# === JSON responses ===
+# Extra calls allowed to finish a JSON reply that hit max_tokens
+JSON_MAX_CONTINUATIONS = int(os.getenv("LLM_JSON_MAX_CONTINUATIONS", "2"))
+
+
+def complete_truncated_json(prompt: str, text: str, temperature: float = 0.0, max_tokens: int = 1000,
+                            use_cache: bool = True, max_continuations: int = None,
+                            model_id: str = None, timeout: int = None) -> str:
+    """
+    If `text` opens a JSON value that never closes, ask Claude to continue from where it stopped
+    (the partial reply goes back as an assistant prefill) instead of re-sending for a full answer.
+    """
+    max_continuations = JSON_MAX_CONTINUATIONS if max_continuations is None else max_continuations
+    for _ in range(max_continuations):
+        if not json_utils.is_truncated(text):
+            break
+        # Bedrock rejects an assistant prefill that ends in whitespace
+        text = text.rstrip()
+        metrics.inc("llm_json_continuations_total", model=model_id or MODEL_ID, stage=metrics.current_stage.get())
+        text += invoke_claude(prompt, temperature, max_tokens, use_cache, prefill=text, model_id=model_id, timeout=timeout)
+    return text
+
+
+def invoke_claude_json(prompt: str, temperature: float = 0.0, max_tokens: int = 1000, use_cache: bool = True,
+                       openers: str = "{", model_id: str = None, timeout: int = None):
+    """invoke_claude plus continuation of truncated replies and local JSON repair; returns the parsed value."""
+    text = invoke_claude(prompt, temperature, max_tokens, use_cache, model_id=model_id, timeout=timeout)
+    text = complete_truncated_json(prompt, text, temperature, max_tokens, use_cache, model_id=model_id, timeout=timeout)
+    try:
+        return json_utils.parse_json_response(text, openers=openers)
+    except json_utils.JsonExtractionError as e:
+        metrics.inc("llm_json_failures_total", model=model_id or MODEL_ID, stage=metrics.current_stage.get(),
+                    truncated=str(e.truncated).lower())
+        raise
+
+
+# === Model tiers and per-task routing ===
+# Each tier carries its own max_tokens and read timeout; short classification answers fit the small tier
+MODEL_TIERS = {
+    "small": {"model_id": os.getenv("LLM_SMALL_MODEL_ID", "anthropic.claude-3-haiku-20240307-v1:0"),
+              "max_tokens": int(os.getenv("LLM_SMALL_MAX_TOKENS", "300")),
+              "timeout": int(os.getenv("LLM_SMALL_TIMEOUT", "20"))},
+    "large": {"model_id": os.getenv("LLM_LARGE_MODEL_ID", MODEL_ID),
+              "max_tokens": int(os.getenv("LLM_LARGE_MAX_TOKENS", "1000")),
+              "timeout": int(os.getenv("LLM_LARGE_TIMEOUT", "60"))},
+}
+TASK_ROUTES = {
+    "expectation_identifier": "small",
+    "eval_criteria_identifier": "small",
+    "win_theme_mapper": "small",
+    "pp_relevance": "small",
+    "fused_tagger": "large",
+    "batch_scoring": "large",
+    "compliance_extraction": "large",
+    "past_performance_metadata": "large",
+}
+ESCALATION_TIER = "large"
+# LLM_ROUTES="pp_relevance=large,..." overrides single routes; LLM_ROUTING=off sends every task to the escalation tier
+LLM_ROUTING = os.getenv("LLM_ROUTING", "on").lower() not in ("0", "off", "false", "no")
+for _route in filter(None, os.getenv("LLM_ROUTES", "").split(",")):
+    _task, _, _tier = _route.partition("=")
+    TASK_ROUTES[_task.strip()] = _tier.strip()
+# Small-tier scores strictly inside this band are treated as low confidence and re-asked on the escalation tier
+ESCALATION_BAND = tuple(float(x) for x in os.getenv("LLM_ESCALATION_BAND", "0.35,0.65").split(","))
+
+
+# Errors that mean the model itself is unusable here (not enabled in the account/region), not this prompt
+TIER_UNAVAILABLE_CODES = {"AccessDeniedException", "ResourceNotFoundException"}
+_unavailable_tiers = set()
+
+
+def _should_escalate_error(exc: Exception) -> bool:
+    """Client errors and timeouts from a lower tier are worth one try on the escalation tier; throttling is not."""
+    if is_throttle(exc):
+        return False
+    return isinstance(getattr(exc, "response", None), dict) or type(exc).__name__ in RETRYABLE_EXCEPTIONS
+
+
+def set_llm_routing(enabled: bool):
+    """Turn per-task routing on or off for this process (e.g. from a --no-llm-routing flag)."""
+    global LLM_ROUTING
+    LLM_ROUTING = enabled
+
+
+def tier_for(task: str) -> str:
+    tier = TASK_ROUTES.get(task, ESCALATION_TIER) if LLM_ROUTING else ESCALATION_TIER
+    if tier not in MODEL_TIERS:
+        raise ValueError(f"Task '{task}' is routed to unknown model tier '{tier}'")
+    return tier
+
+
+def in_escalation_band(score) -> bool:
+    low, high = ESCALATION_BAND
+    return low < float(score) < high
+
+
+def invoke_routed(task: str, prompt: str, parse=None, is_confident=None, expect_json: bool = False,
+                  temperature: float = 0.0, use_cache: bool = True):
+    """
+    Call the model tier routed for `task` and return its answer, passed through JSON extraction
+    (expect_json) and then `parse`. If parsing raises, the call fails with a non-throttle client error or
+    timeout, or `is_confident(result)` is False, the same prompt is re-asked on ESCALATION_TIER; failures
+    on the last tier propagate. A tier whose model is not enabled is skipped for the rest of the process.
+    """
+    first = tier_for(task)
+    if first in _unavailable_tiers:
+        first = ESCALATION_TIER
+    tiers = [first] if first == ESCALATION_TIER else [first, ESCALATION_TIER]
+    for i, name in enumerate(tiers):
+        tier = MODEL_TIERS[name]
+        last = i == len(tiers) - 1
+        try:
+            if expect_json:
+                result = invoke_claude_json(prompt, temperature, tier["max_tokens"], use_cache,
+                                            model_id=tier["model_id"], timeout=tier["timeout"])
+            else:
+                result = invoke_claude(prompt, temperature, tier["max_tokens"], use_cache,
+                                       model_id=tier["model_id"], timeout=tier["timeout"])
+            if parse is not None:
+                result = parse(result)
+        except (ValueError, TypeError, KeyError, AttributeError, IndexError) as e:
+            if last:
+                raise
+            reason = "parse_error"
+            print(f"↗️ [{task}] {name} tier answer unusable ({e}); escalating to {ESCALATION_TIER}")
+        except Exception as e:
+            if last or not _should_escalate_error(e):
+                raise
+            reason = "error"
+            if error_code(e) in TIER_UNAVAILABLE_CODES and name not in _unavailable_tiers:
+                _unavailable_tiers.add(name)
+                print(f"⚠️ {name} tier model {tier['model_id']} is unavailable ({error_code(e)}); "
+                      f"routing its tasks to {ESCALATION_TIER} for the rest of the run")
+            else:
+                print(f"↗️ [{task}] {name} tier call failed ({error_code(e)}); escalating to {ESCALATION_TIER}")
+        else:
+            if last or is_confident is None or is_confident(result):
+                return result
+            reason = "low_confidence"
+        metrics.inc("llm_escalations_total", task=task, tier=name, model=tier["model_id"], reason=reason,
+                    stage=metrics.current_stage.get())
@@ -0,0 +1,64 @@
+# rag/llm_pool.py — bounded concurrent execution for per-chunk Claude calls
+
+import contextvars
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+# Max requests in flight against Bedrock at once (override with LLM_MAX_IN_FLIGHT)
+MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+# Set when the run is failing: pools stop taking new items and return once in-flight calls finish
+stop_event = threading.Event()
+
+
+def run_in_pool(fn: Callable[[Any], Any], items: Iterable[Any],
+                max_in_flight: Optional[int] = None,
+                on_error: Optional[Callable[[Any, Exception], Any]] = None) -> List[Any]:
+    """
+    Apply `fn` to every item on a bounded thread pool and return the results in input order.
+
+    Errors are isolated per item: if `fn` raises, `on_error(item, exc)` is called and its
+    return value takes that item's slot (the exception itself is stored when no handler is given).
+    """
+    return list(iter_in_pool(fn, items, max_in_flight=max_in_flight, on_error=on_error))
+
+
+def iter_in_pool(fn: Callable[[Any], Any], items: Iterable[Any],
+                 max_in_flight: Optional[int] = None,
+                 on_error: Optional[Callable[[Any, Exception], Any]] = None) -> Iterator[Any]:
+    """
+    Streaming form of run_in_pool: pulls items lazily (e.g. from a chunk generator) and yields
+    results in input order, keeping at most 2 × max_in_flight items submitted at any time.
+    Once stop_event is set, no further items are started and only submitted ones are yielded.
+    """
+    workers = max(1, max_in_flight or MAX_IN_FLIGHT)
+
+    def guarded(item):
+        try:
+            return fn(item)
+        except Exception as e:
+            if on_error is not None:
+                return on_error(item, e)
+            return e
+
+    if workers == 1:
+        for item in items:
+            if stop_event.is_set():
+                return
+            yield guarded(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        window = deque()
+        for item in items:
+            if stop_event.is_set():
+                break
+            # Carry the caller's context (e.g. metrics.current_stage) into the worker thread
+            window.append(executor.submit(contextvars.copy_context().run, guarded, item))
+            if len(window) >= workers * 2:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
@@ -0,0 +1,185 @@
+# rag/metrics.py — in-process metrics registry (counters + latency histograms) with JSON and Prometheus export
+
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Tuple
+
+# Stage currently running on this thread; llm_pool copies it into worker threads so LLM calls are attributed
+current_stage = contextvars.ContextVar("current_stage", default="")
+
+# Histograms keep raw samples up to this many per series, then a uniform reservoir
+MAX_SAMPLES = int(os.getenv("METRICS_MAX_SAMPLES", "50000"))
+PERCENTILES = (50, 90, 95, 99)
+
+
+def _series_key(name: str, labels: Dict) -> Tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def _prom_labels(labels: Dict, extra: Dict = None) -> str:
+    items = {**labels, **(extra or {})}
+    if not items:
+        return ""
+    pairs = []
+    for k, v in sorted(items.items()):
+        value = str(v).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{k}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = pct / 100.0 * (len(sorted_values) - 1)
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple, float] = {}
+        self._histograms: Dict[Tuple, Dict] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _series_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _series_key(name, labels)
+        with self._lock:
+            series = self._histograms.setdefault(key, {"count": 0, "sum": 0.0, "samples": []})
+            series["count"] += 1
+            series["sum"] += value
+            if len(series["samples"]) < MAX_SAMPLES:
+                series["samples"].append(value)
+            else:
+                # Algorithm R: the n-th value replaces a random slot with probability MAX_SAMPLES / n
+                slot = random.randrange(series["count"])
+                if slot < MAX_SAMPLES:
+                    series["samples"][slot] = value
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> Dict:
+        """Counters and histogram summaries (count, sum, min, max, percentiles) as plain JSON data."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: (v["count"], v["sum"], sorted(v["samples"])) for k, v in self._histograms.items()}
+
+        out = {"counters": [], "histograms": []}
+        for (name, labels), value in sorted(counters.items()):
+            out["counters"].append({"name": name, "labels": dict(labels), "value": round(value, 6)})
+        for (name, labels), (count, total, samples) in sorted(histograms.items()):
+            summary = {"name": name, "labels": dict(labels), "count": count, "sum": round(total, 6),
+                       "min": round(samples[0], 6) if samples else 0.0,
+                       "max": round(samples[-1], 6) if samples else 0.0}
+            for p in PERCENTILES:
+                summary[f"p{p}"] = round(percentile(samples, p), 6)
+            out["histograms"].append(summary)
+        return out
+
+    def counter_total(self, name: str, **match) -> float:
+        """Sum of a counter across every series whose labels include `match`."""
+        wanted = {k: str(v) for k, v in match.items()}
+        with self._lock:
+            return sum(v for (n, labels), v in self._counters.items()
+                       if n == name and wanted.items() <= dict(labels).items())
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition: counters as-is, histograms as summaries with quantiles."""
+        snap = self.snapshot()
+        lines = []
+        typed = set()
+        for c in snap["counters"]:
+            if c["name"] not in typed:
+                lines.append(f"# TYPE {c['name']} counter")
+                typed.add(c["name"])
+            lines.append(f"{c['name']}{_prom_labels(c['labels'])} {c['value']}")
+        for h in snap["histograms"]:
+            if h["name"] not in typed:
+                lines.append(f"# TYPE {h['name']} summary")
+                typed.add(h["name"])
+            for p in PERCENTILES:
+                lines.append(f"{h['name']}{_prom_labels(h['labels'], {'quantile': p / 100})} {h[f'p{p}']}")
+            lines.append(f"{h['name']}_sum{_prom_labels(h['labels'])} {h['sum']}")
+            lines.append(f"{h['name']}_count{_prom_labels(h['labels'])} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def inc(name: str, value: float = 1, **labels):
+    REGISTRY.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+
+def build_run_report(stages=None, extra: Dict = None) -> Dict:
+    """
+    Roll the registry up into a run report: per-stage wall/CPU time and LLM usage,
+    per-model call/token/cost/latency totals, plus the raw metric series.
+    """
+    snap = REGISTRY.snapshot()
+    by_stage: Dict[str, Dict] = {}
+    by_model: Dict[str, Dict] = {}
+
+    def bucket(table, key):
+        return table.setdefault(key, {"llm_calls": 0, "llm_errors": 0, "cache_hits": 0, "retries": 0,
+                                      "throttles": 0, "escalations": 0, "input_tokens": 0, "output_tokens": 0,
+                                      "cost_usd": 0.0, "llm_seconds": 0.0})
+
+    fields = {"llm_calls_total": "llm_calls", "llm_errors_total": "llm_errors", "llm_cache_hits_total": "cache_hits",
+              "llm_retries_total": "retries", "llm_throttles_total": "throttles", "llm_escalations_total": "escalations",
+              "llm_input_tokens_total": "input_tokens", "llm_output_tokens_total": "output_tokens",
+              "llm_cost_usd_total": "cost_usd", "llm_seconds_total": "llm_seconds"}
+    for c in snap["counters"]:
+        field = fields.get(c["name"])
+        if field is None:
+            continue
+        for table, label in ((by_stage, "stage"), (by_model, "model")):
+            if label in c["labels"]:
+                row = bucket(table, c["labels"][label])
+                row[field] = round(row[field] + c["value"], 6)
+
+    for h in snap["histograms"]:
+        if h["name"] == "llm_latency_seconds" and "model" in h["labels"]:
+            bucket(by_model, h["labels"]["model"])["latency_s"] = {k: h[k] for k in ("count", "min", "max", "p50", "p90", "p95", "p99")}
+        if h["name"] == "stage_wall_seconds":
+            by_stage.setdefault(h["labels"].get("stage", ""), {})["wall_s"] = h["sum"]
+        if h["name"] == "stage_cpu_seconds":
+            by_stage.setdefault(h["labels"].get("stage", ""), {})["cpu_s"] = h["sum"]
+
+    if stages:
+        for stage in stages:
+            if "start" in stage.timing:
+                by_stage.setdefault(stage.name, {}).update(
+                    start_s=round(stage.timing["start"], 3), end_s=round(stage.timing.get("end", 0.0), 3))
+
+    report = {"generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "stages": by_stage, "models": by_model}
+    report.update(extra or {})
+    report["metrics"] = snap
+    return report
+
+
+def save_run_report(report: Dict, output_path: str, prometheus_path: str = None):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"📈 Saved run report to: {output_path}")
+    if prometheus_path:
+        with open(prometheus_path, "w", encoding="utf-8") as f:
+            f.write(REGISTRY.to_prometheus())
+        print(f"📈 Saved Prometheus metrics to: {prometheus_path}")
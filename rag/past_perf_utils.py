@@ -1,7 +1,6 @@
 # rag/past_perf_utils.py
 
-import json
-from rag.llm_client_claude import invoke_claude
+from rag.llm_client_claude import invoke_routed
 
 def extract_project_metadata(full_text, filename):
     print(f"📏 full_text length: {len(full_text)}")
@@ -34,10 +33,8 @@ The filename is: {filename}
 """
         try:
             print(f"🧠 Sending chunk {i+1}/{len(chunks)} to Claude...")
-            response = invoke_claude(prompt)
+            result = invoke_routed("past_performance_metadata", prompt, expect_json=True)
             print("✅ Response received")
-            json_start = response.find("{")
-            result = json.loads(response[json_start:].strip())
             result["sources"] = [filename]
             merged_metadata = merge_projects(merged_metadata, result) if merged_metadata else result
         except Exception as e:
@@ -0,0 +1,57 @@
+# rag/pdf_extract.py — PyMuPDF text extraction with page sharding and exact page provenance
+
+from typing import Dict, List, Tuple
+
+import fitz  # PyMuPDF
+
+# Pages are joined with this separator when offsets are computed (same as the orchestrator's doc join)
+PAGE_SEPARATOR = "\n\n"
+MIN_PAGES_PER_SHARD = 8
+
+
+def count_pages(path: str) -> int:
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def page_shards(page_count: int, workers: int) -> List[Tuple[int, int]]:
+    """Split [0, page_count) into contiguous ranges, at least MIN_PAGES_PER_SHARD pages each."""
+    if page_count <= 0:
+        return []
+    shard_count = max(1, min(workers, page_count // MIN_PAGES_PER_SHARD or 1))
+    size = -(-page_count // shard_count)  # ceil division
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def extract_page_range(path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Return (1-based page number, text) for pages in [start, end). Runs inside worker processes."""
+    pages = []
+    with fitz.open(path) as doc:
+        for index in range(start, end):
+            pages.append((index + 1, doc.load_page(index).get_text("text")))
+    return pages
+
+
+def build_page_records(path: str, pages: List[Tuple[int, str]]) -> List[Dict]:
+    """
+    One record per page, shaped like a serialized Document, with the page number and the
+    character span of the page inside the file's pages joined by PAGE_SEPARATOR.
+    """
+    records = []
+    offset = 0
+    total = len(pages)
+    for page_number, text in sorted(pages):
+        records.append({
+            "page_content": text,
+            "metadata": {
+                "source": path,
+                "page": page_number,
+                "total_pages": total,
+                "start_offset": offset,
+                "end_offset": offset + len(text),
+                "extractor": "pymupdf",
+            }
+        })
+        offset += len(text) + len(PAGE_SEPARATOR)
+    return records
+
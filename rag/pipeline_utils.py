@@ -2,9 +2,12 @@
 
 import os
 import re
-import uuid
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 from dotenv import load_dotenv
 load_dotenv(dotenv_path=".env.local")
@@ -13,6 +16,8 @@ import boto3
 from langchain_community.document_loaders import UnstructuredFileLoader
 from langchain.schema import Document
 
+from rag.pdf_extract import count_pages, page_shards, extract_page_range, build_page_records
+
 # === Load environment variables ===
 AWS_REGION = os.getenv("AWS_REGION")
 S3_BUCKET = os.getenv("S3_BUCKET")
@@ -32,18 +37,77 @@ CHUNK_SIZE = 1500
 CHUNK_OVERLAP = 100
 
 # === S3 file listing ===
-def list_s3_files(bucket: str, prefix: str = "") -> list:
-    response = s3.list_objects_v2(Bucket=bucket, Prefix=prefix)
+def list_s3_objects(bucket: str, prefix: str = "", client=None) -> List[Dict]:
+    # Paginated: list_objects_v2 returns at most 1,000 keys per call
+    paginator = (client or s3).get_paginator("list_objects_v2")
     return [
-        item["Key"]
-        for item in response.get("Contents", [])
+        item
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix)
+        for item in page.get("Contents", [])
         if not item["Key"].endswith("/")
     ]
 
+def list_s3_files(bucket: str, prefix: str = "", client=None) -> list:
+    return [item["Key"] for item in list_s3_objects(bucket, prefix, client=client)]
+
 # === S3 download ===
-def download_s3_file(bucket: str, key: str, dest_path: str):
+def download_s3_file(bucket: str, key: str, dest_path: str, client=None):
     os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-    s3.download_file(bucket, key, dest_path)
+    (client or s3).download_file(bucket, key, dest_path)
+
+# === S3 sync ===
+S3_SYNC_WORKERS = int(os.getenv("S3_SYNC_WORKERS", "8"))
+S3_MANIFEST_NAME = ".s3_manifest.json"
+
+def sync_s3_prefix(bucket: str, prefix: str, local_folder: str, max_workers: int = None, client=None) -> List[str]:
+    """
+    Mirror every object under `prefix` into `local_folder` (flattened to file names, as before).
+    Objects whose ETag and size match the folder's .s3_manifest.json and whose local copy is intact
+    are skipped; the rest download concurrently. Returns the local paths of all synced objects.
+    """
+    os.makedirs(local_folder, exist_ok=True)
+    manifest_path = os.path.join(local_folder, S3_MANIFEST_NAME)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        manifest = {}
+
+    objects = list_s3_objects(bucket, prefix, client=client)
+    to_download = []
+    local_paths = []
+    for item in objects:
+        filename = item["Key"].split("/")[-1]
+        dest_path = os.path.join(local_folder, filename)
+        local_paths.append(dest_path)
+        entry = manifest.get(filename, {})
+        if (entry.get("etag") == item["ETag"] and entry.get("size") == item["Size"]
+                and os.path.exists(dest_path) and os.path.getsize(dest_path) == item["Size"]):
+            continue
+        to_download.append((item, filename, dest_path))
+
+    print(f"☁️ s3://{bucket}/{prefix}: {len(objects)} objects, {len(objects) - len(to_download)} up to date, {len(to_download)} to download")
+
+    def fetch(job):
+        item, filename, dest_path = job
+        download_s3_file(bucket, item["Key"], dest_path, client=client)
+        return filename, {"key": item["Key"], "etag": item["ETag"], "size": item["Size"]}
+
+    workers = max(1, min(max_workers or S3_SYNC_WORKERS, len(to_download) or 1))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fetch, job) for job in to_download]
+        for future in as_completed(futures):
+            try:
+                filename, entry = future.result()
+                manifest[filename] = entry
+            except Exception as e:
+                print(f"❌ S3 download failed: {e}")
+
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return local_paths
 
 # === Local file listing ===
 def list_local_files(folder_path: str, extensions=(".pdf", ".docx", ".pptx", ".xlsx")) -> List[str]:
@@ -54,52 +118,200 @@ def list_local_files(folder_path: str, extensions=(".pdf", ".docx", ".pptx", ".x
     ]
 
 # === Document loading ===
-def load_documents(file_paths: List[str]) -> List[Document]:
+DOC_LOAD_WORKERS = int(os.getenv("DOC_LOAD_WORKERS", str(min(8, os.cpu_count() or 1))))
+DOC_CACHE_DIR = os.getenv("DOC_CACHE_DIR", ".cache/parsed_docs")
+# PDFs go through PyMuPDF page shards unless PDF_FAST_PATH=0 (falls back to Unstructured)
+PDF_FAST_PATH = os.getenv("PDF_FAST_PATH", "1") != "0"
+
+def _extractor_for(file_path: str) -> str:
+    return "pymupdf" if PDF_FAST_PATH and file_path.lower().endswith(".pdf") else "unstructured"
+
+def _doc_cache_path(file_path: str) -> str:
+    # Keyed by absolute path + size + mtime + extractor: any edit to the file invalidates its entry
+    stat = os.stat(file_path)
+    key = f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|{_extractor_for(file_path)}"
+    return os.path.join(DOC_CACHE_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+def _extract_file(file_path: str) -> List[Dict]:
+    # Runs in a worker process, so return plain dicts rather than Document objects
+    loader = UnstructuredFileLoader(file_path)
+    return [{"page_content": d.page_content, "metadata": d.metadata} for d in loader.load()]
+
+def _plan_tasks(file_paths: List[str], workers: int) -> List[Tuple[str, object, tuple]]:
+    """One task per non-PDF file; PDFs are split into page-range shards so large files parallelize too."""
+    tasks = []
+    for file_path in file_paths:
+        if _extractor_for(file_path) == "pymupdf":
+            try:
+                for start, end in page_shards(count_pages(file_path), workers):
+                    tasks.append((file_path, extract_page_range, (file_path, start, end)))
+                continue
+            except Exception as e:
+                print(f"⚠️ PyMuPDF could not open {file_path} ({e}); using Unstructured")
+        tasks.append((file_path, _extract_file, (file_path,)))
+    return tasks
+
+def load_documents(file_paths: List[str], max_workers: int = None, use_cache: bool = True) -> List[Document]:
+    results = {}
+    to_parse = []
+
+    for file_path in file_paths:
+        if use_cache:
+            try:
+                with open(_doc_cache_path(file_path), "r", encoding="utf-8") as f:
+                    results[file_path] = json.load(f)
+                continue
+            except (OSError, json.JSONDecodeError):
+                pass
+        to_parse.append(file_path)
+
+    if file_paths:
+        print(f"📄 {len(file_paths) - len(to_parse)} documents from parse cache, {len(to_parse)} to parse")
+
+    workers = max(1, max_workers or DOC_LOAD_WORKERS)
+    tasks = _plan_tasks(to_parse, workers)
+    outputs = {}   # file_path -> Unstructured docs, or (page, text) pairs from PDF shards
+    failed = set()
+
+    def collect(file_path, fn, output):
+        if fn is extract_page_range:
+            outputs.setdefault(file_path, []).extend(output)
+        else:
+            outputs[file_path] = output
+
+    if min(workers, len(tasks)) > 1:
+        # Spawned, not forked: other stages' threads (S3 downloads, LLM calls) may hold locks at fork time
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {executor.submit(fn, *args): (fp, fn) for fp, fn, args in tasks}
+            for future in as_completed(futures):
+                file_path, fn = futures[future]
+                try:
+                    collect(file_path, fn, future.result())
+                except Exception as e:
+                    failed.add(file_path)
+                    print(f"Failed to load {file_path}: {e}")
+    else:
+        for file_path, fn, args in tasks:
+            try:
+                collect(file_path, fn, fn(*args))
+            except Exception as e:
+                failed.add(file_path)
+                print(f"Failed to load {file_path}: {e}")
+
+    for file_path in to_parse:
+        if file_path in failed or file_path not in outputs:
+            continue
+        parsed = outputs[file_path]
+        if parsed and isinstance(parsed[0], tuple):
+            parsed = build_page_records(file_path, parsed)
+        results[file_path] = parsed
+        if use_cache:
+            os.makedirs(DOC_CACHE_DIR, exist_ok=True)
+            with open(_doc_cache_path(file_path), "w", encoding="utf-8") as f:
+                json.dump(parsed, f)
+
+    # Keep the caller's file order regardless of completion order
     docs = []
     for file_path in file_paths:
-        try:
-            loader = UnstructuredFileLoader(file_path)
-            docs.extend(loader.load())
-        except Exception as e:
-            print(f"Failed to load {file_path}: {e}")
+        for d in results.get(file_path, []):
+            docs.append(Document(page_content=d["page_content"], metadata=d["metadata"]))
     return docs
 
 # === Hierarchical chunking ===
-def hierarchical_chunk(text: str, max_chunk_size=CHUNK_SIZE) -> List[str]:
-    paragraphs = re.split(r'\n\s*\n', text.strip())
-    chunks = []
-    buffer = ""
+PARAGRAPH_REGEX = re.compile(r"\S(?:.*?\S)?(?=\n\s*\n|\s*\Z)", re.DOTALL)
+SENTENCE_END_REGEX = re.compile(r"(?<=[.!?;:])\s+")
 
-    for para in paragraphs:
-        para = para.strip()
-        if not para:
-            continue
+def _split_oversize(text: str, start: int, end: int, max_chunk_size: int) -> List[Tuple[int, int]]:
+    """Break text[start:end] into spans under max_chunk_size, on sentence ends, else on whitespace."""
+    pieces = []
+    piece_start = start
+    for m in SENTENCE_END_REGEX.finditer(text, start, end):
+        pieces.append((piece_start, m.start()))
+        piece_start = m.end()
+    pieces.append((piece_start, end))
 
-        if len(buffer) + len(para) < max_chunk_size:
-            buffer += "\n\n" + para
+    spans = []
+    for p_start, p_end in pieces:
+        # A single run-on "sentence" (tables, lists without punctuation) is cut at the last space
+        while p_end - p_start > max_chunk_size:
+            cut = text.rfind(" ", p_start + 1, p_start + max_chunk_size)
+            cut = cut if cut > p_start else p_start + max_chunk_size
+            spans.append((p_start, cut))
+            p_start = cut
+            while p_start < p_end and text[p_start].isspace():
+                p_start += 1
+        if p_end > p_start:
+            spans.append((p_start, p_end))
+    return spans
+
+def chunk_text_with_offsets(text: str, max_chunk_size=CHUNK_SIZE, base_offset: int = 0) -> List[Dict]:
+    """
+    Pack paragraphs into chunks under max_chunk_size, splitting oversize paragraphs on sentence
+    boundaries. Each chunk is {"text", "start_offset", "end_offset"}, where text == source[start:end]
+    and offsets are shifted by base_offset (the document's position in the joined solicitation text).
+    """
+    spans = []
+    for m in PARAGRAPH_REGEX.finditer(text):
+        if m.end() - m.start() > max_chunk_size:
+            spans.extend(_split_oversize(text, m.start(), m.end(), max_chunk_size))
         else:
-            chunks.append(buffer.strip())
-            buffer = para
+            spans.append((m.start(), m.end()))
+
+    chunks = []
+    buffer_start = buffer_end = None
+    for start, end in spans:
+        if buffer_start is not None and end - buffer_start >= max_chunk_size:
+            chunks.append((buffer_start, buffer_end))
+            buffer_start = None
+        if buffer_start is None:
+            buffer_start = start
+        buffer_end = end
+    if buffer_start is not None:
+        chunks.append((buffer_start, buffer_end))
+
+    return [
+        {"text": text[start:end], "start_offset": base_offset + start, "end_offset": base_offset + end}
+        for start, end in chunks
+    ]
 
-    if buffer:
-        chunks.append(buffer.strip())
+def hierarchical_chunk(text: str, max_chunk_size=CHUNK_SIZE) -> List[str]:
+    return [c["text"] for c in chunk_text_with_offsets(text, max_chunk_size)]
 
-    return chunks
+# === Deterministic chunk IDs ===
+def make_chunk_id(source: str, chunk_text: str) -> str:
+    # Same document + same normalized content => same ID on every run
+    normalized = re.sub(r"\s+", " ", chunk_text).strip().lower()
+    digest = hashlib.sha1(f"{Path(source).name}\n{normalized}".encode("utf-8")).hexdigest()
+    return digest[:12]
 
 # === Chunk documents and enrich metadata ===
 def chunk_documents(documents: List[Document], opportunity_name: str) -> List[Dict]:
     all_chunks = []
+    seen_ids = {}
+    doc_offset = 0  # offsets are positions in "\n\n".join(page_content), the text sections are parsed from
 
     for doc in documents:
         raw_text = doc.page_content
         source = doc.metadata.get("source", "unknown")
 
-        split_chunks = hierarchical_chunk(raw_text)
+        split_chunks = chunk_text_with_offsets(raw_text, base_offset=doc_offset)
+        doc_offset += len(raw_text) + 2
+
+        for split in split_chunks:
+            chunk_text = split["text"]
+            chunk_id = make_chunk_id(source, chunk_text)
+            # Repeated boilerplate within a document gets an ordinal suffix
+            seen_ids[chunk_id] = seen_ids.get(chunk_id, 0) + 1
+            if seen_ids[chunk_id] > 1:
+                chunk_id = f"{chunk_id}-{seen_ids[chunk_id]}"
 
-        for chunk_text in split_chunks:
             chunk = {
-                "chunk_id": f"{uuid.uuid4().hex[:8]}",
+                "chunk_id": chunk_id,
                 "text": chunk_text,
+                "page": doc.metadata.get("page"),
+                "start_offset": split["start_offset"],
+                "end_offset": split["end_offset"],
                 "metadata": {
                     "opportunity_name": opportunity_name,
                     "source_document": source,
@@ -111,6 +323,39 @@ def chunk_documents(documents: List[Document], opportunity_name: str) -> List[Di
 
     return all_chunks
 
+# === Incremental re-tagging ===
+def load_previous_chunks(path: str) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def has_failed_tags(metadata: Dict) -> bool:
+    """True when any agent tag is a placeholder left by a failed Claude call rather than a real answer."""
+    if "fallback" in metadata.get("agent_sources", {}).values():
+        return True
+    win_theme = metadata.get("agent_tags", {}).get("win_theme_mapper")
+    return isinstance(win_theme, dict) and win_theme.get("label") == "error"
+
+def carry_forward_tags(chunks: List[Dict], previous_chunks: List[Dict]) -> List[Dict]:
+    """
+    Copy agent tags from a previous run onto chunks whose chunk_id is unchanged.
+    Returns the chunks that are new, changed, or whose previous tagging failed, and still need tagging.
+    """
+    previous_by_id = {c["chunk_id"]: c for c in previous_chunks if "chunk_id" in c}
+    pending = []
+    for chunk in chunks:
+        previous = previous_by_id.get(chunk["chunk_id"])
+        if previous is None or has_failed_tags(previous.get("metadata", {})):
+            pending.append(chunk)
+            continue
+        prev_meta = previous.get("metadata", {})
+        chunk["metadata"]["agent_tags"] = dict(prev_meta.get("agent_tags", {}))
+        for key in ("agent_rationales", "agent_sources"):
+            if key in prev_meta:
+                chunk["metadata"][key] = dict(prev_meta[key])
+    return pending
+
 # === Read Capture file(s) ===
 from langchain_community.document_loaders import UnstructuredFileLoader  # make sure to use new path
 
@@ -1,19 +1,44 @@
 # rag/pp_matcher.py — tag solicitation chunks with relevant past performance references
 
 import json
-import os
 from pathlib import Path
-from rag.llm_client_claude import invoke_claude
-
-
-def tag_chunks_with_pp(chunks, past_perf_projects):
-    tagged_chunks = []
-
-    for chunk in chunks:
+from rag.llm_client_claude import invoke_routed, in_escalation_band
+from rag.llm_pool import run_in_pool
+from rag.pp_retrieval import build_project_index, shortlist_projects, PP_TOP_K, PP_MIN_SCORE
+
+
+def parse_relevance(result):
+    """A relevance answer must be an object with `relevant`; `confidence` is coerced to a float (default 0)."""
+    if not isinstance(result, dict) or "relevant" not in result:
+        raise ValueError("Relevance answer has no 'relevant' field")
+    result["confidence"] = float(result.get("confidence") or 0)
+    return result
+
+
+def tag_chunks_with_pp(chunks, past_perf_projects, max_in_flight=None, top_k=PP_TOP_K, min_score=PP_MIN_SCORE,
+                       on_tagged=None):
+    """
+    Tag chunks with relevant past performance projects.
+    A local TF-IDF stage shortlists up to top_k projects per chunk (cosine >= min_score);
+    only those pairs are sent to Claude. Pass top_k=None to assess every pair.
+    on_tagged(chunk_id, relevant_projects) fires for chunks whose candidate calls all succeeded.
+    """
+    index = build_project_index(past_perf_projects) if top_k else None
+    llm_pairs = []
+
+    def tag_one(chunk):
         relevant_projects = []
+        failed = False
         chunk_text = chunk["text"]
 
-        for project in past_perf_projects:
+        if index is not None:
+            candidates = shortlist_projects(index, chunk_text, top_k=top_k, min_score=min_score)
+        else:
+            candidates = [(i, None) for i in range(len(past_perf_projects))]
+        llm_pairs.append(len(candidates))
+
+        for project_idx, retrieval_score in candidates:
+            project = past_perf_projects[project_idx]
             # Safe extraction of project_name
             cid = project.get("contract_identification")
             project_name = None
@@ -21,7 +46,8 @@ def tag_chunks_with_pp(chunks, past_perf_projects):
             if isinstance(cid, dict):
                 project_name = cid.get("program_title") or \
                                cid.get("contract_name") or \
-                               cid.get("project_name")
+                               cid.get("project_name") or \
+                               cid.get("name")
 
             if not project_name:
                 project_name = project.get("sources", ["Unnamed Project"])[0]
@@ -46,43 +72,61 @@ Project Metadata:
 Return only a JSON object.
 """
             try:
-                response = invoke_claude(prompt)
-                result = json.loads(response[response.find("{"):])
+                result = invoke_routed("pp_relevance", prompt, expect_json=True, parse=parse_relevance,
+                                       is_confident=lambda r: not in_escalation_band(r["confidence"]))
                 if result.get("relevant"):
                     relevant_projects.append({
                         "project_name": project_name,
                         "source": project.get("sources", ["unknown"])[0],
                         "confidence": result.get("confidence", 0),
+                        "retrieval_score": retrieval_score,
                         "matched_fields": result.get("matched_fields", [])
                     })
             except Exception as e:
                 print(f"⚠️ Skipping project '{project_name}' due to error: {e}")
+                failed = True
                 continue
 
         if relevant_projects:
             chunk.setdefault("metadata", {}).setdefault("agent_tags", {})["pp_matcher"] = relevant_projects
+        if failed:
+            chunk.setdefault("metadata", {}).setdefault("agent_sources", {})["pp_matcher"] = "fallback"
+        if on_tagged and not failed:
+            on_tagged(chunk["chunk_id"], relevant_projects)
+
+        return chunk
 
-        tagged_chunks.append(chunk)
+    def keep_untagged(chunk, e):
+        print(f"⚠️ pp_matcher failed for chunk {chunk.get('chunk_id')}: {e}")
+        return chunk
 
+    tagged_chunks = run_in_pool(tag_one, chunks, max_in_flight=max_in_flight, on_error=keep_untagged)
+    print(f"📉 [pp_matcher] {sum(llm_pairs)} LLM calls for "
+          f"{len(chunks) * len(past_perf_projects)} chunk × project pairs")
     return tagged_chunks
 
 
 if __name__ == "__main__":
-    opportunity = "VALGY"
-    base_path = f"data/opportunities/{opportunity}"
-    chunk_path = os.path.join(base_path, "tagged_chunks.json")
-    pp_json_path = os.path.join(base_path, "past_perf_projects.json")
+    import sys
+    from rag.chunk_store import ChunkWriter, iter_chunks, resolve_chunks_path
+    from rag.project_paths import get_past_perf_json_path, get_tagged_chunks_jsonl_path
+
+    if len(sys.argv) != 3:
+        print("Usage: python -m rag.pp_matcher <portfolio> <opportunity>")
+        sys.exit(1)
+    portfolio, opportunity = sys.argv[1], sys.argv[2]
 
-    with open(chunk_path, "r", encoding="utf-8") as f:
-        chunks = json.load(f)
+    jsonl_path = get_tagged_chunks_jsonl_path(portfolio, opportunity)
+    chunks = list(iter_chunks(resolve_chunks_path(jsonl_path)))
 
-    with open(pp_json_path, "r", encoding="utf-8") as f:
+    with open(get_past_perf_json_path(portfolio, opportunity), "r", encoding="utf-8") as f:
         past_perf_projects = json.load(f)
 
     print(f"🔍 Tagging {len(chunks)} chunks using {len(past_perf_projects)} past performance projects...")
     tagged = tag_chunks_with_pp(chunks, past_perf_projects)
 
-    with open(chunk_path, "w", encoding="utf-8") as f:
-        json.dump(tagged, f, indent=2)
+    with ChunkWriter(jsonl_path) as writer:
+        for chunk in tagged:
+            writer.write(chunk)
 
-    print(f"✅ pp_matcher tags added to {chunk_path}")
+    print(f"✅ pp_matcher tags added to {jsonl_path}")
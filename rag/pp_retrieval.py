@@ -0,0 +1,62 @@
+# rag/pp_retrieval.py — local TF-IDF shortlist of past performance projects per chunk
+
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from rag.keyword_theme_analyzer import STOPWORDS
+
+# Candidates per chunk that reach the LLM, and the cosine floor below which a project is dropped
+PP_TOP_K = int(os.getenv("PP_RETRIEVAL_TOP_K", "5"))
+PP_MIN_SCORE = float(os.getenv("PP_RETRIEVAL_MIN_SCORE", "0.05"))
+
+TOKEN_REGEX = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_REGEX.findall(text.lower()) if t not in STOPWORDS and len(t) > 2]
+
+
+def project_text(project: Dict) -> str:
+    """Flatten every metadata field of a past performance project into one searchable string."""
+    fields = {k: v for k, v in project.items() if k != "sources"}
+    return json.dumps(fields, ensure_ascii=False)
+
+
+def build_project_index(projects: List[Dict]) -> Dict:
+    docs = [Counter(tokenize(project_text(p))) for p in projects]
+    n = len(docs)
+    df = Counter(term for doc in docs for term in doc)
+    idf = {term: math.log((1 + n) / (1 + count)) + 1.0 for term, count in df.items()}
+
+    vectors = []
+    for doc in docs:
+        weights = {term: (1 + math.log(tf)) * idf[term] for term, tf in doc.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        vectors.append({term: w / norm for term, w in weights.items()})
+
+    return {"idf": idf, "vectors": vectors}
+
+
+def shortlist_projects(index: Dict, text: str, top_k: int = PP_TOP_K,
+                       min_score: float = PP_MIN_SCORE) -> List[Tuple[int, float]]:
+    """Return (project_index, cosine_similarity) pairs for the top_k projects scoring at least min_score."""
+    idf = index["idf"]
+    tf = Counter(t for t in tokenize(text) if t in idf)
+    if not tf:
+        return []
+
+    query = {term: (1 + math.log(count)) * idf[term] for term, count in tf.items()}
+    norm = math.sqrt(sum(w * w for w in query.values())) or 1.0
+
+    scored = []
+    for i, vector in enumerate(index["vectors"]):
+        score = sum(w * vector.get(term, 0.0) for term, w in query.items()) / norm
+        if score >= min_score:
+            scored.append((i, round(score, 4)))
+
+    scored.sort(key=lambda x: x[1], reverse=True)
+    return scored[:top_k] if top_k else scored
@@ -3,21 +3,52 @@
 import os
 import re
 import json
+from bisect import bisect_right
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 
 SECTION_REGEX = re.compile(r"^(\d{1,2}(\.\d{1,2})*)\s+(.+)")
 
 
-def extract_toc_and_sections(text: str) -> Dict:
-    lines = text.splitlines()
+def page_breaks_from_docs(docs, separator: str = "\n\n") -> List[Tuple[int, Optional[int]]]:
+    """
+    (offset, page) pairs marking where each document starts in separator.join(docs).
+    A document whose loader didn't record pages (e.g. Unstructured output for .docx files) gets page None,
+    so it doesn't inherit the previous PDF's last page; inside it pages come from "Page N" footers.
+    Empty when no document has pages.
+    """
+    breaks = []
+    offset = 0
+    for doc in docs:
+        page = doc.metadata.get("page")
+        if page is not None or (breaks and breaks[-1][1] is not None):
+            breaks.append((offset, page))
+        offset += len(doc.page_content) + len(separator)
+    return breaks
+
+
+def extract_toc_and_sections(text: str, page_breaks: Optional[List[Tuple[int, Optional[int]]]] = None) -> Dict:
+    # With page_breaks (from page_breaks_from_docs) page numbers come from extractor provenance;
+    # without them, and inside documents with page None, we fall back to spotting "Page N" footers in the text
     toc = []
     sections = []
+    heading_offsets = []  # every heading occurrence, so body headings win over their TOC entries
     current_page = 1
     seen_headings = set()
-
-    for line in lines:
-        line = line.strip()
+    page_breaks = page_breaks or []
+    next_break = 0
+    provenance_page = None  # page of the current line from the extractor, None when unknown
+    offset = 0
+
+    for raw_line in text.splitlines(keepends=True):
+        line_offset = offset
+        offset += len(raw_line)
+        while next_break < len(page_breaks) and page_breaks[next_break][0] <= line_offset:
+            provenance_page = page_breaks[next_break][1]
+            if provenance_page is None:
+                current_page = 1  # a page-less document starts counting afresh
+            next_break += 1
+        line = raw_line.strip()
         if not line:
             continue
 
@@ -26,23 +57,60 @@ def extract_toc_and_sections(text: str) -> Dict:
             heading_id = match.group(1)
             heading_text = match.group(3).strip()
             full_heading = f"{heading_id} {heading_text}"
+            heading_offset = line_offset + len(raw_line) - len(raw_line.lstrip())
+            heading_offsets.append([heading_offset, heading_id])
 
             if full_heading not in seen_headings:
                 toc.append(full_heading)
-                sections.append({"id": heading_id, "heading": full_heading, "page": current_page})
+                if provenance_page is not None:
+                    current_page = provenance_page
+                sections.append({"id": heading_id, "heading": full_heading, "page": current_page, "offset": heading_offset})
                 seen_headings.add(full_heading)
 
-        if "page" in line.lower():
+        if provenance_page is None and "page" in line.lower():
             page_match = re.search(r"page\s*(\d+)", line.lower())
             if page_match:
                 current_page = int(page_match.group(1))
 
     return {
         "toc": toc,
-        "sections": sections
+        "sections": sections,
+        "heading_offsets": heading_offsets
     }
 
 
+def assign_sections(chunks: List[Dict], parsed: Dict, page_breaks: Optional[List[Tuple[int, Optional[int]]]] = None) -> List[Dict]:
+    """
+    Set section_id (and page, when the extractor didn't supply one) on each chunk from its start_offset:
+    the governing section is the last heading at or before the chunk's first character.
+    """
+    headings = sorted((offset, heading_id) for offset, heading_id in parsed.get("heading_offsets", []))
+    heading_starts = [h[0] for h in headings]
+    break_offsets = [b[0] for b in page_breaks] if page_breaks else []
+    page_by_id = {s["id"]: s["page"] for s in parsed.get("sections", [])}
+
+    for chunk in chunks:
+        start = chunk.get("start_offset")
+        if start is None:
+            continue
+        index = bisect_right(heading_starts, start) - 1
+        # A chunk can open mid-section; the first heading inside it is a better label than none
+        if index < 0 and heading_starts and heading_starts[0] < chunk.get("end_offset", start):
+            index = 0
+        if index >= 0:
+            chunk["section_id"] = headings[index][1]
+        if chunk.get("page") is None:
+            page = None
+            page_index = bisect_right(break_offsets, start) - 1
+            if page_index >= 0:
+                page = page_breaks[page_index][1]
+            if page is None and index >= 0:
+                # No extractor page here (a page-less document): use the section's footer-derived page
+                page = page_by_id.get(headings[index][1])
+            chunk["page"] = page
+    return chunks
+
+
 def save_parsed_context(parsed: Dict, output_path: str):
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     with open(output_path, "w", encoding="utf-8") as f:
@@ -60,7 +128,7 @@ def enrich_chunks_with_breadcrumbs(chunks: List[Dict], section_map: Dict[str, Di
     enriched = []
     for chunk in chunks:
         section_id = chunk.get("section_id")  # assumes chunk carries its section ID like "4.2"
-        page = chunk.get("page", 0)
+        page = chunk.get("page") or 0
         section_info = section_map.get(section_id, {"heading": "Unknown"})
         chunk["text"] = inject_breadcrumbs(chunk["text"], section_info, page)
         enriched.append(chunk)
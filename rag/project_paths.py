@@ -12,6 +12,9 @@ def get_eval_criteria_path(portfolio: str, opportunity: str) -> str:
 def get_tagged_chunks_path(portfolio: str, opportunity: str) -> str:
     return f"data/{portfolio}/opportunities/{opportunity}/tagged_chunks.json"
 
+def get_tagged_chunks_jsonl_path(portfolio: str, opportunity: str) -> str:
+    return f"data/{portfolio}/opportunities/{opportunity}/tagged_chunks.jsonl"
+
 def get_capture_json_path(portfolio: str, opportunity: str) -> str:
     return f"data/{portfolio}/opportunities/{opportunity}/capture_parsed.json"
 
@@ -29,3 +32,6 @@ def get_s3_past_perf_prefix(portfolio: str, opportunity: str) -> str:
 
 def get_portfolio_past_perf_folder(portfolio: str, opportunity: str) -> str:
     return f"data/{portfolio}/opportunities/{opportunity}/past_performance/"
+
+def get_checkpoint_path(portfolio: str, opportunity: str) -> str:
+    return f"data/{portfolio}/opportunities/{opportunity}/checkpoint.jsonl"
@@ -0,0 +1,183 @@
+# rag/rate_control.py — shared Bedrock rate control: AIMD concurrency limit, token bucket and jittered retries
+#
+# Bedrock quotas are per model, so each model ID gets its own bucket and limiter, shared by every thread.
+
+import os
+import random
+import threading
+import time
+
+from rag import metrics
+
+# Optional hard cap in requests/second per model across all threads, for accounts whose quota is known.
+# Off by default (0) so the AIMD limit below is free to grow until Bedrock actually throttles.
+# Burst defaults to one second's worth.
+LLM_MAX_RPS = float(os.getenv("LLM_MAX_RPS", "0"))
+LLM_BURST = float(os.getenv("LLM_BURST", "0")) or max(1.0, LLM_MAX_RPS)
+# In-flight Bedrock calls start here and adapt between the floor and ceiling
+LLM_AIMD_INITIAL = int(os.getenv("LLM_AIMD_INITIAL", "4"))
+LLM_AIMD_MIN = int(os.getenv("LLM_AIMD_MIN", "1"))
+LLM_AIMD_MAX = int(os.getenv("LLM_AIMD_MAX", "64"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "6"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+
+THROTTLE_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException"}
+# Transient server-side and network failures that are worth another attempt
+RETRYABLE_CODES = THROTTLE_CODES | {"ServiceUnavailableException", "InternalServerException",
+                                    "ModelTimeoutException", "ModelNotReadyException"}
+RETRYABLE_EXCEPTIONS = {"ReadTimeoutError", "ConnectTimeoutError", "EndpointConnectionError",
+                        "ConnectionClosedError", "ConnectionError", "TimeoutError"}
+
+
+def error_code(exc: Exception) -> str:
+    """Bedrock error code for a botocore ClientError, else the exception class name."""
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):
+        code = response.get("Error", {}).get("Code")
+        if code:
+            return code
+    return type(exc).__name__
+
+
+def is_throttle(exc: Exception) -> bool:
+    return error_code(exc) in THROTTLE_CODES
+
+
+def is_retryable(exc: Exception) -> bool:
+    return error_code(exc) in RETRYABLE_CODES or type(exc).__name__ in RETRYABLE_EXCEPTIONS
+
+
+class TokenBucket:
+    """Classic token bucket shared by every thread; acquire() blocks until a token is available."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AimdLimiter:
+    """
+    Concurrency limit that grows by one after a full window of successes (additive increase)
+    and halves on throttling (multiplicative decrease), at most once per cooldown so one burst
+    of 429s counts as a single congestion signal.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, decrease: float = 0.5, cooldown_s: float = 1.0,
+                 model_id: str = ""):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.decrease = decrease
+        self.cooldown_s = cooldown_s
+        self.model_id = model_id
+        self.in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def on_success(self):
+        with self._cond:
+            self._successes += 1
+            if self._successes >= int(self.limit) and self.limit < self.maximum:
+                self._successes = 0
+                self.limit += 1
+                metrics.observe("llm_concurrency_limit", self.limit, model=self.model_id)
+                self._cond.notify()
+
+    def on_throttle(self):
+        with self._cond:
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown_s:
+                return
+            self._last_decrease = now
+            self._successes = 0
+            self.limit = max(self.minimum, self.limit * self.decrease)
+            metrics.observe("llm_concurrency_limit", self.limit, model=self.model_id)
+
+
+_controls = {}
+_controls_lock = threading.Lock()
+# AIMD sizing for limiters created from now on; reset_controls() can pin it (e.g. per load-test level)
+_aimd_limits = {"initial": LLM_AIMD_INITIAL, "maximum": LLM_AIMD_MAX}
+
+
+def controls_for(model_id: str):
+    """The (TokenBucket, AimdLimiter) pair for a model, created on first use."""
+    with _controls_lock:
+        if model_id not in _controls:
+            _controls[model_id] = (TokenBucket(LLM_MAX_RPS, LLM_BURST),
+                                   AimdLimiter(_aimd_limits["initial"], LLM_AIMD_MIN, _aimd_limits["maximum"],
+                                               model_id=model_id))
+        return _controls[model_id]
+
+
+def reset_controls(initial: int = None, maximum: int = None):
+    """
+    Drop every model's bucket and limiter so the next call starts fresh, optionally starting at `initial`
+    in-flight calls and capped at `maximum` (both default to LLM_AIMD_INITIAL / LLM_AIMD_MAX).
+    """
+    with _controls_lock:
+        _controls.clear()
+        _aimd_limits["initial"] = LLM_AIMD_INITIAL if initial is None else initial
+        _aimd_limits["maximum"] = LLM_AIMD_MAX if maximum is None else maximum
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(max, base * 2^attempt)]."""
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+
+def call_with_rate_control(fn, model_id: str = ""):
+    """
+    Run fn() under the model's token bucket and AIMD limit, retrying throttles, timeouts and
+    transient 5xx errors with jittered backoff. Non-retryable errors, and the last failure, propagate.
+    """
+    stage = metrics.current_stage.get()
+    bucket, limiter = controls_for(model_id)
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        bucket.acquire()
+        limiter.acquire()
+        try:
+            result = fn()
+        except Exception as e:
+            limiter.release()
+            if is_throttle(e):
+                limiter.on_throttle()
+                metrics.inc("llm_throttles_total", model=model_id, stage=stage)
+            if not is_retryable(e) or attempt == LLM_MAX_ATTEMPTS - 1:
+                raise
+            metrics.inc("llm_retries_total", model=model_id, stage=stage)
+            time.sleep(backoff_delay(attempt))
+            continue
+        limiter.release()
+        limiter.on_success()
+        return result
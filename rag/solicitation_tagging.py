@@ -1,7 +1,26 @@
 # rag/solicitation_tagging.py
 
-from typing import List, Dict
-from rag.llm_client_claude import invoke_claude
+from typing import Any, Callable, List, Dict, Optional
+from rag.llm_client_claude import invoke_routed, in_escalation_band
+from rag.llm_pool import run_in_pool
+
+
+def parse_score_line(response: str) -> float:
+    """Score from the first line mentioning 'score' ("Score: 0.8"); raises ValueError when there is none."""
+    score_line = next((l for l in response.splitlines() if "score" in l.lower()), None)
+    if score_line is None:
+        raise ValueError("No score line in response")
+    return float(score_line.split(":")[-1].strip())
+
+
+def parse_agent_line(response: str, fields: int = 2) -> List[str]:
+    """Split "agent: <score> - <label> - <rationale>" into its dash-separated parts (score first)."""
+    if ":" not in response:
+        raise ValueError("No 'agent: score' line in response")
+    parts = [p.strip() for p in response.split(":")[1].strip().split("-", fields - 1)]
+    float(parts[0])
+    return parts
+
 
 # === 1. Expectation Identifier ===
 def build_expectation_prompt(text: str) -> str:
@@ -19,17 +38,16 @@ Expectation Identifier: 0.87 - Mentions of submission deadlines and response for
 
 # rag/solicitation_tagging.py
 
-def tag_expectation_identifier(chunks, capture_context=None):
-    from rag.llm_client_claude import invoke_claude
-
-    tagged = []
+def tag_expectation_identifier(chunks, capture_context=None, max_in_flight: Optional[int] = None,
+                               batch_tokens: Optional[int] = None,
+                               on_tagged: Optional[Callable[[str, Any], None]] = None):
     win_theme_text = ""
     if capture_context and isinstance(capture_context, dict):
         win_theme_text = "\n\n".join(
             ["* " + item for section in capture_context.values() for item in section]
         )[:4000]  # keep it bounded
 
-    for chunk in chunks:
+    def tag_one(chunk):
         win_theme_block = f"Here are the known client win themes:\n{win_theme_text}\n\n" if win_theme_text else ""
         prompt = (
             "You are a federal RFP response analyst.\n\n"
@@ -43,28 +61,51 @@ def tag_expectation_identifier(chunks, capture_context=None):
             "Reason: <short explanation>"
         )
 
+        tagged_ok = False
         try:
-            response = invoke_claude(prompt)
-            score_line = next((l for l in response.splitlines() if "score" in l.lower()), None)
-            #score = float(score_line.split(":")[-1].strip()) if score_line else 0.0
-            score = float(score_line.split(":")[-1].strip()) if score_line else 0.0
+            score = invoke_routed("expectation_identifier", prompt, parse=parse_score_line,
+                                  is_confident=lambda s: not in_escalation_band(s))
             short_text = chunk['text'][:80].strip().replace('\\n', ' ').replace('\"', '')
             print(f"🔍 [expectation_identifier] {chunk['chunk_id']} | Score: {score} | Text: {short_text}...")
+            tagged_ok = True
 
 
-        except Exception:
+        except Exception as e:
+            print(f"❌ Claude failed for expectation_identifier: {e}")
             score = 0.0
 
         chunk.setdefault("metadata", {}).setdefault("agent_tags", {})
         chunk["metadata"]["agent_tags"]["expectation_identifier"] = score
-        tagged.append(chunk)
+        if not tagged_ok:
+            # Placeholder score; the marker lets --incremental runs retry the chunk
+            chunk["metadata"].setdefault("agent_sources", {})["expectation_identifier"] = "fallback"
+        if on_tagged and tagged_ok:
+            on_tagged(chunk["chunk_id"], score)
+        return chunk
+
+    def keep_untagged(chunk, e):
+        print(f"❌ expectation_identifier failed for chunk {chunk.get('chunk_id')}: {e}")
+        return chunk
+
+    pending = chunks
+    if batch_tokens:
+        win_theme_block = f"Here are the known client win themes:\n{win_theme_text}\n\n" if win_theme_text else ""
+        pending = score_chunks_batched(
+            chunks, "expectation_identifier",
+            "Identify whether each chunk contains implicit or explicit expectations from the client. "
+            "Score from 0.0 (no expectations) to 1.0 (strong expectations).",
+            batch_tokens, context_block=win_theme_block, max_in_flight=max_in_flight, on_tagged=on_tagged
+        )
 
-    return tagged
+    run_in_pool(tag_one, pending, max_in_flight=max_in_flight, on_error=keep_untagged)
+    return list(chunks)
 
 
 # === 2. Evaluation Criteria Identifier ===
-def tag_eval_criteria_chunks(chunks: List[Dict]) -> List[Dict]:
-    for chunk in chunks:
+def tag_eval_criteria_chunks(chunks: List[Dict], max_in_flight: Optional[int] = None,
+                             batch_tokens: Optional[int] = None,
+                             on_tagged: Optional[Callable[[str, Any], None]] = None) -> List[Dict]:
+    def tag_one(chunk):
         prompt = f"""
 You are analyzing a government RFP.
 
@@ -86,28 +127,43 @@ Read the chunk of text below and determine whether it describes **evaluation cri
 Only respond in this format.
 """
         try:
-            response = invoke_claude(prompt)
-            print(f"\n🔍 [eval_criteria_identifier] Chunk {chunk['chunk_id']}:\n{response}")
-            score = 0.0
-            if ":" in response:
-                parts = response.split(":")[1].strip().split("-", 1)
-                score = round(float(parts[0]), 2)
+            parts = invoke_routed("eval_criteria_identifier", prompt, parse=parse_agent_line,
+                                  is_confident=lambda p: not in_escalation_band(p[0]))
+            print(f"\n🔍 [eval_criteria_identifier] Chunk {chunk['chunk_id']}:\n{' - '.join(parts)}")
+            score = round(float(parts[0]), 2)
 
             chunk["metadata"].setdefault("agent_tags", {})["eval_criteria_identifier"] = score
+            if on_tagged:
+                on_tagged(chunk["chunk_id"], score)
 
         except Exception as e:
             print(f"❌ Claude failed for eval_criteria_identifier: {e}")
             chunk["metadata"].setdefault("agent_tags", {})["eval_criteria_identifier"] = 0.0
+            # The 0.0 is a placeholder, not Claude's answer; keeps it out of classifier training data
+            chunk["metadata"].setdefault("agent_sources", {})["eval_criteria_identifier"] = "fallback"
+
+    pending = chunks
+    if batch_tokens:
+        pending = score_chunks_batched(
+            chunks, "eval_criteria_identifier",
+            "Determine whether each chunk describes evaluation criteria, basis for award, technical scoring "
+            "factors, or proposal evaluation methods. Score 0.0 if nothing evaluation-related is found and "
+            "1.0 if the chunk clearly contains evaluation factors or scoring instructions.",
+            batch_tokens, max_in_flight=max_in_flight, on_tagged=on_tagged
+        )
 
+    run_in_pool(tag_one, pending, max_in_flight=max_in_flight)
     return chunks
 
 # === 3. Win Theme Mapper using structured capture JSON ===
-def tag_win_theme_mapper(chunks: List[Dict], capture_data: dict, criteria_text: str) -> List[Dict]:
+def tag_win_theme_mapper(chunks: List[Dict], capture_data: dict, criteria_text: str,
+                         max_in_flight: Optional[int] = None,
+                         on_tagged: Optional[Callable[[str, Any], None]] = None) -> List[Dict]:
     pain_points = "\n- ".join(capture_data.get("pain_points", []))
     win_themes = "\n- ".join(capture_data.get("win_themes", []))
     differentiators = "\n- ".join(capture_data.get("differentiators", []))
 
-    for chunk in chunks:
+    def tag_one(chunk):
         prompt = f"""
 You are a proposal strategist helping analyze a government RFP.
 
@@ -143,19 +199,18 @@ win_theme_mapper: 0.85 - differentiator - Highlights our rapid deployment capabi
 Only respond in this format.
 """
         try:
-            response = invoke_claude(prompt)
-            print(f"\n🔍 [win_theme_mapper] Chunk {chunk['chunk_id']}:\n{response}")
-            score = 0.0
-            label = "none"
-            if ":" in response:
-                parts = response.split(":")[1].strip().split("-", 2)
-                score = round(float(parts[0]), 2)
-                label = parts[1].strip().lower()
+            parts = invoke_routed("win_theme_mapper", prompt, parse=lambda r: parse_agent_line(r, fields=3),
+                                  is_confident=lambda p: not in_escalation_band(p[0]))
+            print(f"\n🔍 [win_theme_mapper] Chunk {chunk['chunk_id']}:\n{' - '.join(parts)}")
+            score = round(float(parts[0]), 2)
+            label = parts[1].lower() if len(parts) > 1 else "none"
 
             chunk["metadata"].setdefault("agent_tags", {})["win_theme_mapper"] = {
                 "score": score,
                 "label": label
             }
+            if on_tagged:
+                on_tagged(chunk["chunk_id"], chunk["metadata"]["agent_tags"]["win_theme_mapper"])
 
         except Exception as e:
             print(f"❌ Claude failed for win_theme_mapper: {e}")
@@ -163,5 +218,175 @@ Only respond in this format.
                 "score": 0.0,
                 "label": "error"
             }
+            chunk["metadata"].setdefault("agent_sources", {})["win_theme_mapper"] = "fallback"
 
+    run_in_pool(tag_one, chunks, max_in_flight=max_in_flight)
     return chunks
+
+# === 4. Fused tagger: expectation + eval criteria + win theme in one call ===
+FUSED_AGENTS = ("expectation_identifier", "eval_criteria_identifier", "win_theme_mapper")
+
+def build_fused_prompt(text: str, capture_data: dict, criteria_text: str = "") -> str:
+    pain_points = "\n- ".join(capture_data.get("pain_points", []))
+    win_themes = "\n- ".join(capture_data.get("win_themes", []))
+    differentiators = "\n- ".join(capture_data.get("differentiators", []))
+    criteria_block = f"### Evaluation Criteria (from RFP):\n{criteria_text.strip()[:3000]}\n\n" if criteria_text.strip() else ""
+
+    return f"""
+You are a federal RFP response analyst and proposal strategist.
+
+Assess the solicitation chunk below on three independent questions:
+1. expectation_identifier: does it contain implicit or explicit expectations from the client? (0.0 none - 1.0 strong)
+2. eval_criteria_identifier: does it describe evaluation criteria, basis for award, technical scoring factors, or proposal evaluation methods? (0.0 none - 1.0 clearly)
+3. win_theme_mapper: does it express or imply a pain point, a win theme, or a differentiator, given the capture context? (0.0 none - 1.0 strong)
+
+---
+
+### Pain Points:
+{pain_points[:1000]}
+
+### Win Themes:
+{win_themes[:1000]}
+
+### Differentiators:
+{differentiators[:1000]}
+
+{criteria_block}### Chunk:
+{text.strip()}
+
+---
+
+Respond with only this JSON object:
+{{
+  "expectation_identifier": {{"score": <float>, "rationale": "<short explanation>"}},
+  "eval_criteria_identifier": {{"score": <float>, "rationale": "<1-line rationale>"}},
+  "win_theme_mapper": {{"score": <float>, "label": "pain point | win theme | differentiator | none", "rationale": "<1-line rationale>"}}
+}}
+"""
+
+
+def tag_chunks_fused(chunks: List[Dict], capture_data: dict, criteria_text: str = "",
+                     max_in_flight: Optional[int] = None,
+                     on_tagged: Optional[Callable[[str, Any], None]] = None) -> List[Dict]:
+    """
+    One Claude call per chunk that fills the expectation_identifier, eval_criteria_identifier
+    and win_theme_mapper tags with the same shapes as the per-agent taggers.
+    Rationales are kept under metadata.agent_rationales.
+    """
+    def tag_one(chunk):
+        prompt = build_fused_prompt(chunk["text"], capture_data, criteria_text)
+        tags = chunk.setdefault("metadata", {}).setdefault("agent_tags", {})
+        rationales = chunk["metadata"].setdefault("agent_rationales", {})
+        try:
+            result = invoke_routed("fused_tagger", prompt, expect_json=True)
+
+            expectation = result.get("expectation_identifier") or {}
+            eval_criteria = result.get("eval_criteria_identifier") or {}
+            win_theme = result.get("win_theme_mapper") or {}
+
+            tags["expectation_identifier"] = float(expectation.get("score", 0.0))
+            tags["eval_criteria_identifier"] = round(float(eval_criteria.get("score", 0.0)), 2)
+            tags["win_theme_mapper"] = {
+                "score": round(float(win_theme.get("score", 0.0)), 2),
+                "label": str(win_theme.get("label", "none")).strip().lower()
+            }
+            for agent, entry in (("expectation_identifier", expectation),
+                                 ("eval_criteria_identifier", eval_criteria),
+                                 ("win_theme_mapper", win_theme)):
+                if entry.get("rationale"):
+                    rationales[agent] = entry["rationale"]
+            if on_tagged:
+                on_tagged(chunk["chunk_id"], {agent: tags[agent] for agent in FUSED_AGENTS})
+
+            print(f"🔍 [fused_tagger] {chunk['chunk_id']} | "
+                  f"expectation={tags['expectation_identifier']} "
+                  f"eval={tags['eval_criteria_identifier']} "
+                  f"win_theme={tags['win_theme_mapper']['score']} ({tags['win_theme_mapper']['label']})")
+
+        except Exception as e:
+            print(f"❌ Claude failed for fused_tagger on chunk {chunk.get('chunk_id')}: {e}")
+            tags["expectation_identifier"] = 0.0
+            tags["eval_criteria_identifier"] = 0.0
+            tags["win_theme_mapper"] = {"score": 0.0, "label": "error"}
+            sources = chunk["metadata"].setdefault("agent_sources", {})
+            for agent in FUSED_AGENTS:
+                sources[agent] = "fallback"
+
+    run_in_pool(tag_one, chunks, max_in_flight=max_in_flight)
+    return chunks
+
+
+# === 5. Batched scoring: N chunks per prompt, answers keyed by chunk_id ===
+MAX_CHUNKS_PER_BATCH = 40  # keeps the JSON answer well inside max_tokens=1000
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def pack_batches(chunks: List[Dict], batch_tokens: int) -> List[List[Dict]]:
+    """Greedily pack chunks into batches whose estimated chunk tokens stay within batch_tokens."""
+    batches, current, used = [], [], 0
+    for chunk in chunks:
+        cost = estimate_tokens(chunk["text"]) + 10  # id header + delimiters
+        if current and (used + cost > batch_tokens or len(current) >= MAX_CHUNKS_PER_BATCH):
+            batches.append(current)
+            current, used = [], 0
+        current.append(chunk)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def build_batch_prompt(task: str, batch: List[Dict], context_block: str = "") -> str:
+    chunk_blocks = "\n\n".join(
+        f'### chunk_id: {chunk["chunk_id"]}\n"""\n{chunk["text"].strip()}\n"""' for chunk in batch
+    )
+    return f"""
+You are a federal RFP response analyst reviewing several chunks of a government solicitation.
+
+{task}
+
+{context_block}{chunk_blocks}
+
+---
+
+Return only a JSON object mapping every chunk_id above to its score (a float between 0.0 and 1.0), e.g.
+{{"{batch[0]["chunk_id"]}": 0.0}}
+"""
+
+
+def score_chunks_batched(chunks: List[Dict], agent: str, task: str, batch_tokens: int,
+                         context_block: str = "", max_in_flight: Optional[int] = None,
+                         on_tagged: Optional[Callable[[str, Any], None]] = None) -> List[Dict]:
+    """
+    Score chunks for `agent` with multi-chunk prompts sized by batch_tokens.
+    Returns the chunks that came back without a usable score so the caller can re-queue them individually.
+    """
+    batches = pack_batches(chunks, batch_tokens)
+    print(f"📦 [{agent}] {len(chunks)} chunks packed into {len(batches)} batched prompts")
+
+    def score_batch(batch):
+        scores = invoke_routed("batch_scoring", build_batch_prompt(task, batch, context_block), expect_json=True)
+        missing = []
+        for chunk in batch:
+            try:
+                score = round(float(scores[chunk["chunk_id"]]), 2)
+            except (KeyError, TypeError, ValueError):
+                missing.append(chunk)
+                continue
+            chunk.setdefault("metadata", {}).setdefault("agent_tags", {})[agent] = score
+            if on_tagged:
+                on_tagged(chunk["chunk_id"], score)
+        return missing
+
+    def requeue_batch(batch, e):
+        print(f"⚠️ [{agent}] batched call failed, re-queuing {len(batch)} chunks individually: {e}")
+        return batch
+
+    missing = [chunk for result in run_in_pool(score_batch, batches, max_in_flight=max_in_flight, on_error=requeue_batch)
+               for chunk in result]
+    if missing:
+        print(f"🔁 [{agent}] {len(missing)} chunks missing from batched answers, re-queuing individually")
+    return missing
@@ -0,0 +1,129 @@
+# rag/stage_graph.py — declared pipeline stages run as a dependency graph
+
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Tuple
+
+from rag import metrics
+from rag.llm_pool import stop_event
+
+
+@dataclass
+class Stage:
+    """A pipeline step: `fn(**inputs)` returns a dict holding every name listed in `outputs`."""
+    name: str
+    fn: Callable[..., Dict]
+    inputs: Tuple[str, ...] = ()
+    outputs: Tuple[str, ...] = ()
+    timing: Dict[str, float] = field(default_factory=dict)
+
+
+def validate_stages(stages: List[Stage], initial: Dict):
+    producers = {}
+    for stage in stages:
+        for out in stage.outputs:
+            if out in producers:
+                raise ValueError(f"Output '{out}' is produced by both '{producers[out]}' and '{stage.name}'")
+            producers[out] = stage.name
+    for stage in stages:
+        for name in stage.inputs:
+            if name not in producers and name not in initial:
+                raise ValueError(f"Stage '{stage.name}' needs '{name}', which nothing produces")
+    return producers
+
+
+def _run_stage(stage: Stage, inputs: Dict) -> Dict:
+    # CPU is this stage thread's own time; LLM calls on pool threads report latency/tokens under the stage label
+    metrics.current_stage.set(stage.name)
+    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+    try:
+        return stage.fn(**inputs)
+    finally:
+        stage.timing["cpu"] = time.thread_time() - cpu_start
+        metrics.observe("stage_wall_seconds", time.perf_counter() - wall_start, stage=stage.name)
+        metrics.observe("stage_cpu_seconds", stage.timing["cpu"], stage=stage.name)
+
+
+def run_stage_graph(stages: List[Stage], initial: Dict = None, max_workers: int = 4) -> Dict:
+    """
+    Run every stage as soon as all of its inputs exist, with independent stages in parallel.
+    Returns the final context (initial values plus every stage output).
+    """
+    context = dict(initial or {})
+    validate_stages(stages, context)
+    pending = list(stages)
+    running = {}
+    t_start = time.time()
+
+    stop_event.clear()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while pending or running:
+            for stage in [s for s in pending if all(name in context for name in s.inputs)]:
+                pending.remove(stage)
+                stage.timing["start"] = time.time() - t_start
+                print(f"▶️ [stage] {stage.name} started")
+                inputs = {name: context[name] for name in stage.inputs}
+                running[executor.submit(contextvars.copy_context().run, _run_stage, stage, inputs)] = stage
+
+            if not running:
+                blocked = ", ".join(s.name for s in pending)
+                raise RuntimeError(f"Stage graph is stuck; unresolved inputs for: {blocked}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                stage.timing["end"] = time.time() - t_start
+                result = future.result() or {}
+                missing = [name for name in stage.outputs if name not in result]
+                if missing:
+                    raise RuntimeError(f"Stage '{stage.name}' did not return outputs: {missing}")
+                for name in stage.outputs:
+                    context[name] = result[name]
+                print(f"✅ [stage] {stage.name} done in {round(stage.timing['end'] - stage.timing['start'], 2)}s")
+    except BaseException:
+        # Fail fast: don't sit in the executor's shutdown waiting for sibling stages (possibly hours
+        # of LLM calls) before the error surfaces. Running stages can't be interrupted, but their
+        # LLM pools stop starting new calls, so they wind down once in-flight calls return.
+        stop_event.set()
+        for future in running:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+    return context
+
+
+def critical_path(stages: List[Stage]) -> List[Stage]:
+    """Walk back from the last stage to finish through whichever input arrived last."""
+    producers = {out: stage for stage in stages for out in stage.outputs}
+    finished = [s for s in stages if "end" in s.timing]
+    if not finished:
+        return []
+
+    path = [max(finished, key=lambda s: s.timing["end"])]
+    while True:
+        upstream = [producers[name] for name in path[-1].inputs if name in producers]
+        if not upstream:
+            break
+        path.append(max(upstream, key=lambda s: s.timing["end"]))
+    return list(reversed(path))
+
+
+def print_timing_summary(stages: List[Stage]):
+    print("\n⏱️ Stage timing summary:")
+    for stage in sorted(stages, key=lambda s: s.timing.get("start", 0.0)):
+        start, end = stage.timing.get("start"), stage.timing.get("end")
+        if start is None or end is None:
+            continue
+        print(f"  - {stage.name}: {round(end - start, 2)}s (t+{round(start, 2)}s → t+{round(end, 2)}s)")
+
+    path = critical_path(stages)
+    if path:
+        total = round(path[-1].timing["end"] - path[0].timing["start"], 2)
+        print(f"\n🧭 Critical path ({total}s): " + " → ".join(
+            f"{s.name} ({round(s.timing['end'] - s.timing['start'], 2)}s)" for s in path
+        ))
@@ -3,14 +3,14 @@
 import os
 import sys
 import json
-import re
 from pathlib import Path
 from dotenv import load_dotenv
 from rag.project_paths import (
     get_past_perf_folder, get_past_perf_json_path, get_s3_past_perf_prefix
 )
-from rag.pipeline_utils import list_local_files, list_s3_files, download_s3_file
-from rag.llm_client_claude import invoke_claude
+from rag.pipeline_utils import list_local_files, sync_s3_prefix
+from rag.llm_client_claude import invoke_routed
+from rag.json_utils import JsonExtractionError
 
 load_dotenv(dotenv_path=".env.local")
 
@@ -23,30 +23,13 @@ local_folder = get_past_perf_folder(portfolio, opportunity)
 
 # Step 1: Download past performance files from S3
 print(f"📦 Syncing past performance files from S3: {s3_prefix}")
-os.makedirs(local_folder, exist_ok=True)
-s3_keys = list_s3_files(bucket, s3_prefix)
-for key in s3_keys:
-    filename = key.split("/")[-1]
-    download_s3_file(bucket, key, os.path.join(local_folder, filename))
+sync_s3_prefix(bucket, s3_prefix, local_folder)
 
 # Step 2: Parse each document and extract metadata
 print("🔍 Parsing past performance documents for structured metadata...")
 files = list_local_files(local_folder)
 projects = []
 
-def extract_json_from_response(response: str) -> dict:
-    try:
-        json_start = response.find("{")
-        json_like = response[json_start:]
-        match = re.search(r"\{.*\}", json_like, re.DOTALL)
-        if match:
-            return json.loads(match.group())
-        else:
-            raise ValueError("No valid JSON object found.")
-    except Exception as e:
-        print(f"❌ JSON parsing error: {e}")
-        return None
-
 for path in files:
     try:
         print(f"📄 Extracting: {path}")
@@ -66,8 +49,13 @@ Return JSON with fields:
 
 Respond in pure JSON only.
 """
-        response = invoke_claude(prompt + "\n\nTEXT:\n" + content.decode("utf-8", errors="ignore")[:7000])
-        project_data = extract_json_from_response(response)
+        try:
+            project_data = invoke_routed("past_performance_metadata",
+                                         prompt + "\n\nTEXT:\n" + content.decode("utf-8", errors="ignore")[:7000],
+                                         expect_json=True)
+        except JsonExtractionError as e:
+            print(f"❌ JSON parsing error: {e}")
+            project_data = None
         if project_data:
             project_data["sources"] = [Path(path).name]
             projects.append(project_data)
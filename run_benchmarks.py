@@ -0,0 +1,257 @@
+# run_benchmarks.py — timing suite for the Phase 1 hot paths on synthetic 10/100/1,000-page corpora
+#
+#   python run_benchmarks.py                      # run, write benchmarks/results.json, compare to baseline
+#   python run_benchmarks.py --sizes 10,100 --e2e-sizes 10
+#   python run_benchmarks.py --save-baseline      # accept the current numbers as benchmarks/baseline.json
+#
+# The end-to-end case records one orchestrator run against rag/bedrock_stub.py, then times a replayed run
+# (LLM_MODE=replay), so it needs no AWS credentials but does need PyMuPDF and boto3 installed.
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+from io import StringIO
+
+from langchain.schema import Document
+
+from rag.pipeline_utils import hierarchical_chunk, chunk_documents
+from rag.preparse_solicitation import extract_toc_and_sections, page_breaks_from_docs
+from rag.keyword_theme_analyzer import extract_terms, merge_similar_themes
+from rag.past_perf_utils import merge_projects
+
+BENCH_DIR = "benchmarks"
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+RESULTS_PATH = os.path.join(BENCH_DIR, "results.json")
+
+VOCAB = ("cloud security network data platform migration modernization agile devops zero trust identity "
+         "analytics dashboard pipeline incident response monitoring compliance training helpdesk "
+         "infrastructure application sustainment cybersecurity architecture integration testing").split()
+NORMATIVE = ["The contractor shall {}.", "The offeror must {}.", "Proposals will be evaluated on {}.",
+             "Deliverables are due no later than {} after award.", "Responses shall not exceed 25 pages and address {}."]
+
+
+# === Synthetic corpora ===
+def _sentence(rng):
+    words = rng.sample(VOCAB, rng.randint(6, 12))
+    if rng.random() < 0.3:
+        return rng.choice(NORMATIVE).format(" ".join(words[:5]))
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_pages(pages: int, seed: int = 7):
+    """Solicitation-like pages (~3,000 chars): numbered headings, paragraphs, bullets and a page footer."""
+    rng = random.Random(seed)
+    texts = []
+    section = 0
+    for page in range(1, pages + 1):
+        parts = []
+        while sum(len(p) for p in parts) < 2800:
+            if rng.random() < 0.15:
+                section += 1
+                parts.append(f"{section // 10 + 1}.{section % 10} {' '.join(rng.sample(VOCAB, 3)).title()}")
+            elif rng.random() < 0.2:
+                parts.append("\n".join(f"• {_sentence(rng)}" for _ in range(rng.randint(2, 5))))
+            else:
+                parts.append(" ".join(_sentence(rng) for _ in range(rng.randint(3, 8))))
+        parts.append(f"Page {page}")
+        texts.append("\n\n".join(parts))
+    return texts
+
+
+def synthetic_docs(pages: int):
+    return [Document(page_content=text, metadata={"source": "synthetic_solicitation.pdf", "page": i})
+            for i, text in enumerate(synthetic_pages(pages), start=1)]
+
+
+def synthetic_themes(count: int, seed: int = 11):
+    rng = random.Random(seed)
+    themes = []
+    for _ in range(count):
+        name = " ".join(rng.sample(VOCAB, rng.randint(1, 3))).title()
+        if rng.random() < 0.3:
+            name += rng.choice(["s", " Services", " Support"])
+        themes.append({"theme": name, "keywords": rng.sample(VOCAB, 4)})
+    return themes
+
+
+def synthetic_project_updates(count: int, seed: int = 13):
+    rng = random.Random(seed)
+    updates = []
+    for i in range(count):
+        updates.append((f"project-{rng.randint(0, max(1, count // 5))}", {
+            "contract_identification": {"contract_number": f"GS-{rng.randint(1000, 9999)}"},
+            "scope_and_work_type": rng.sample(VOCAB, 5),
+            "client_and_agency": {"agency": rng.choice(["DHS", "DoD", "VA", "GSA"])},
+            "period_of_performance": f"{rng.randint(2015, 2023)}-{rng.randint(2024, 2028)}",
+            "sources": [f"pp_{i}.pdf"],
+        }))
+    return updates
+
+
+# === Timing ===
+@contextmanager
+def _quiet():
+    with redirect_stdout(StringIO()):
+        yield
+
+
+def time_call(fn, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        with _quiet():
+            started = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - started)
+    return {"min_s": round(min(timings), 6), "median_s": round(statistics.median(timings), 6), "runs": repeat}
+
+
+def micro_benchmarks(pages: int, repeat: int):
+    docs = synthetic_docs(pages)
+    full_text = "\n\n".join(d.page_content for d in docs)
+    page_breaks = page_breaks_from_docs(docs)
+    themes = synthetic_themes(pages * 5)
+    term_counter = extract_terms(full_text)
+    updates = synthetic_project_updates(pages * 2)
+
+    def run_merge_projects():
+        projects = {}
+        for key, update in updates:
+            projects[key] = merge_projects(projects.get(key, {}), json.loads(json.dumps(update)))
+
+    cases = {
+        "hierarchical_chunk": lambda: hierarchical_chunk(full_text),
+        "chunk_documents": lambda: chunk_documents(docs, "benchmark"),
+        "extract_toc_and_sections": lambda: extract_toc_and_sections(full_text, page_breaks=page_breaks),
+        "extract_terms": lambda: extract_terms(full_text),
+        "merge_similar_themes": lambda: merge_similar_themes(themes, term_counter),
+        "merge_projects": run_merge_projects,
+    }
+    return {f"{pages}p/{name}": time_call(fn, repeat) for name, fn in cases.items()}
+
+
+def e2e_benchmark(pages: int, repeat: int):
+    """Record a full orchestrator run against the local Bedrock stub, then time replayed runs."""
+    import fitz  # PyMuPDF, to write the synthetic solicitation as a real PDF
+    from rag.bedrock_stub import StubConfig, start_stub
+    from rag.llm_client_claude import set_bedrock_endpoint, set_llm_mode, set_cache_enabled
+    import run_solicitation_analysis
+
+    portfolio, opportunity = "bench", f"synthetic_{pages}p"
+    previous_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="rag_bench_") as workdir:
+        os.chdir(workdir)
+        server = None
+        try:
+            base = f"data/{portfolio}/opportunities/{opportunity}"
+            os.makedirs(f"{base}/solicitation", exist_ok=True)
+            pdf = fitz.open()
+            for text in synthetic_pages(pages):
+                pdf.new_page().insert_textbox(fitz.Rect(36, 36, 576, 756), text, fontsize=6)
+            pdf.save(f"{base}/solicitation/synthetic_solicitation.pdf")
+            with open(f"{base}/capture_parsed.json", "w", encoding="utf-8") as f:
+                json.dump([{"section": "win_themes", "text": "Zero trust modernization"},
+                           {"section": "pain_points", "text": "Legacy helpdesk backlog"},
+                           {"section": "discriminators", "text": "Cleared DevSecOps team"}], f)
+
+            argv = [portfolio, opportunity, "--skip-download", "--no-doc-cache", "--no-llm-cache"]
+            server, endpoint_url = start_stub(StubConfig(latency="fixed:0"))
+            set_bedrock_endpoint(endpoint_url)
+            set_cache_enabled(False)
+            recordings = os.path.join(workdir, "recordings.jsonl")
+
+            set_llm_mode("record", recordings)
+            with _quiet():
+                run_solicitation_analysis.main(argv)
+            set_llm_mode("replay", recordings, replay_latency="none")
+            return {f"{pages}p/e2e_replayed": time_call(lambda: run_solicitation_analysis.main(argv), repeat)}
+        finally:
+            set_llm_mode("live")
+            set_bedrock_endpoint(os.getenv("BEDROCK_ENDPOINT_URL") or None)
+            if server is not None:
+                server.shutdown()
+            os.chdir(previous_cwd)
+
+
+# === Baseline comparison ===
+def compare(results: dict, baseline: dict, tolerance: float, noise_floor_s: float):
+    """Return rows of (name, baseline_s, current_s, ratio, status) using median times."""
+    rows = []
+    for name, current in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            rows.append((name, None, current["median_s"], None, "new"))
+            continue
+        ratio = current["median_s"] / base["median_s"] if base["median_s"] else float("inf")
+        slower = current["median_s"] - base["median_s"] > noise_floor_s and ratio > 1 + tolerance
+        rows.append((name, base["median_s"], current["median_s"], ratio, "REGRESSION" if slower else "ok"))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Phase 1 hot paths against a stored baseline")
+    parser.add_argument("--sizes", default="10,100,1000", help="Corpus sizes in pages for the micro benchmarks")
+    parser.add_argument("--e2e-sizes", default="10,100", help="Corpus sizes for the replayed orchestrator run ('' to skip)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=RESULTS_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Write these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--noise-floor-ms", type=float, default=5.0, help="Ignore differences smaller than this")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for pages in [int(s) for s in args.sizes.split(",") if s]:
+        print(f"⏱️ Micro benchmarks on {pages} pages...")
+        results.update(micro_benchmarks(pages, args.repeat))
+    for pages in [int(s) for s in args.e2e_sizes.split(",") if s]:
+        print(f"⏱️ Replayed end-to-end run on {pages} pages...")
+        try:
+            results.update(e2e_benchmark(pages, args.repeat))
+        except ImportError as e:
+            print(f"⚠️ Skipping end-to-end benchmark: {e}")
+
+    report = {
+        "meta": {"python": platform.python_version(), "platform": platform.platform(),
+                 "cpu_count": os.cpu_count(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"📄 Saved benchmark results to: {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"📌 Saved new baseline to: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("⚠️ No baseline found; run with --save-baseline to create one")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+
+    regressions = 0
+    print(f"\n{'benchmark':<36} {'baseline':>10} {'current':>10} {'ratio':>7}  status")
+    for name, base_s, current_s, ratio, status in compare(results, baseline, args.tolerance, args.noise_floor_ms / 1000):
+        base_txt = f"{base_s:.4f}" if base_s is not None else "-"
+        ratio_txt = f"{ratio:.2f}x" if ratio is not None else "-"
+        print(f"{name:<36} {base_txt:>10} {current_s:>10.4f} {ratio_txt:>7}  {status}")
+        regressions += status == "REGRESSION"
+    if regressions:
+        print(f"\n❌ {regressions} benchmark(s) slower than baseline by more than {args.tolerance:.0%}")
+        return 1
+    print("\n✅ No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
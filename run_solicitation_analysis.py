@@ -2,131 +2,85 @@
 
 import os
 import json
+import sys
 import argparse
 from pathlib import Path
 from dotenv import load_dotenv
 import time
-from concurrent.futures import ThreadPoolExecutor
+import threading
 from collections import defaultdict
 
 from rag.project_paths import (
     get_s3_prefix, get_local_folder, get_eval_criteria_path,
-    get_tagged_chunks_path, get_capture_json_path, get_past_perf_json_path
+    get_tagged_chunks_path, get_tagged_chunks_jsonl_path, get_capture_json_path, get_past_perf_json_path,
+    get_checkpoint_path
 )
 from rag.pipeline_utils import (
-    list_s3_files, download_s3_file, list_local_files,
-    load_documents, chunk_documents
+    sync_s3_prefix, list_local_files,
+    load_documents, chunk_documents, load_previous_chunks, carry_forward_tags
 )
 from rag.solicitation_tagging import (
-    tag_expectation_identifier, tag_eval_criteria_chunks, tag_win_theme_mapper
+    tag_expectation_identifier, tag_eval_criteria_chunks, tag_win_theme_mapper, tag_chunks_fused
 )
 from rag.extract_capture_themes import parse_all_capture_files, save_capture_json
-from rag.preparse_solicitation import extract_toc_and_sections, save_parsed_context, enrich_chunks_with_breadcrumbs
+from rag.preparse_solicitation import extract_toc_and_sections, save_parsed_context, enrich_chunks_with_breadcrumbs, page_breaks_from_docs, assign_sections
 from rag.extract_past_performance import extract_project_metadata, infer_project_name, merge_projects
 from rag.pp_matcher import tag_chunks_with_pp
+from rag.pp_retrieval import PP_TOP_K
 from rag.compliance_tagger import tag_compliance_chunks
+from rag.cheap_classifier import cascade_eval_criteria, cascade_report, save_cascade_report
+from rag.compliance_dedup import build_compliance_matrix, save_compliance_matrix
 from rag.keyword_theme_analyzer import analyze_keywords_from_chunks
+from rag.llm_client_claude import set_cache_enabled, cache_stats, set_llm_mode, set_llm_routing
+from rag import metrics
+from rag.stage_graph import Stage, run_stage_graph, print_timing_summary
+from rag.checkpoint import CheckpointLog
+from rag.chunk_store import ChunkWriter, export_chunks_json, iter_chunks, resolve_chunks_path
 
 load_dotenv(dotenv_path=".env.local")
 
-start_time = time.time()
-
-parser = argparse.ArgumentParser()
-parser.add_argument("portfolio")
-parser.add_argument("opportunity")
-parser.add_argument("--force-capture", action="store_true")
-parser.add_argument("--test-limit", type=int, default=None)
-args = parser.parse_args()
-
-portfolio = args.portfolio
-opportunity = args.opportunity
-local_folder = get_local_folder(portfolio, opportunity)
-s3_prefix = get_s3_prefix(portfolio, opportunity)
-bucket = os.getenv("S3_BUCKET")
-
-print(f"\n🗓️ Downloading S3 files for {portfolio}/{opportunity} ...")
-s3_keys = list_s3_files(bucket, prefix=s3_prefix)
-for key in s3_keys:
-    filename = key.split("/")[-1]
-    download_s3_file(bucket, key, os.path.join(local_folder, filename))
-
-print("\n📄 Loading and chunking solicitation documents...")
-file_paths = [p for p in list_local_files(local_folder) if not Path(p).name.lower().startswith("capture")]
-docs = load_documents(file_paths)
-chunks = chunk_documents(docs, opportunity_name=opportunity)
-
-print("\n📚 Extracting TOC/sections and enriching chunks with breadcrumbs...")
-full_text = "\n\n".join([doc.page_content for doc in docs])
-parsed_context = extract_toc_and_sections(full_text)
-parsed_context_path = f"data/{portfolio}/opportunities/{opportunity}/parsed_context.json"
-save_parsed_context(parsed_context, parsed_context_path)
-section_map = {s["id"]: s for s in parsed_context["sections"] if "id" in s}
-chunks = enrich_chunks_with_breadcrumbs(chunks, section_map)
-if args.test_limit:
-    chunks = chunks[:args.test_limit]
-
-print("\n🎯 Parsing capture files...")
-capture_path = get_capture_json_path(portfolio, opportunity)
-if args.force_capture or not os.path.exists(capture_path):
-    capture_data = parse_all_capture_files(local_folder)
-    save_capture_json(capture_data, capture_path)
-else:
-    with open(capture_path, "r", encoding="utf-8") as f:
-        capture_data = json.load(f)
-
-grouped_capture_data = {
-    "pain_points": [c["text"] for c in capture_data if c["section"] == "pain_points"],
-    "win_themes": [c["text"] for c in capture_data if c["section"] == "win_themes"],
-    "differentiators": [c["text"] for c in capture_data if c["section"] == "discriminators"]
-} if isinstance(capture_data, list) else capture_data
-
-print("\n📂 Extracting past performance metadata...")
-pp_folder = f"data/{portfolio}/opportunities/{opportunity}/past_performance/"
-pp_output_path = get_past_perf_json_path(portfolio, opportunity)
-pp_docs = load_documents(list_local_files(pp_folder))
-projects_by_name = {}
-for doc in pp_docs:
-    fname = Path(doc.metadata.get("source", "unknown")).name
-    metadata = extract_project_metadata(doc.page_content, fname)
-    if not metadata:
-        continue
-    cid = metadata.get("contract_identification")
-    if not cid:
-        continue
-    pname = infer_project_name(cid, fname)
-    key = pname.strip().lower()
-    projects_by_name[key] = merge_projects(projects_by_name.get(key, {}), metadata)
-with open(pp_output_path, "w", encoding="utf-8") as f:
-    json.dump(list(projects_by_name.values()), f, indent=2)
-
-print("\n🤖 Running taggers sequentially...")
-t0 = time.time()
-chunks1 = tag_expectation_identifier(chunks, capture_context=grouped_capture_data)
-chunks2 = tag_eval_criteria_chunks(chunks)
-criteria_text = "\n\n".join([c["text"] for c in chunks2 if c["metadata"]["agent_tags"].get("eval_criteria_identifier", 0.0) >= 0.7])
-chunks3 = tag_win_theme_mapper(chunks, grouped_capture_data, criteria_text)
-chunks4 = tag_chunks_with_pp(chunks, list(projects_by_name.values()))
-compliance_response, compliance_performance = tag_compliance_chunks(chunks)
-
-output_dir = f"data/{portfolio}/opportunities/{opportunity}"
-os.makedirs(output_dir, exist_ok=True)
-with open(os.path.join(output_dir, "compliance_response.json"), "w") as f:
-    json.dump(compliance_response, f, indent=2)
-with open(os.path.join(output_dir, "compliance_performance.json"), "w") as f:
-    json.dump(compliance_performance, f, indent=2)
-
-print("\n\n🔧 Merging agent outputs...")
-merged_by_id = defaultdict(dict)
-for chunk_list in [chunks1, chunks2, chunks3, chunks4]:
-    for chunk in chunk_list:
-        merged_by_id[chunk["chunk_id"]].update(chunk)
-
-tagged_chunks = list(merged_by_id.values())
-
-print("\n🔁 Matching past performance to solicitation chunks...")
-tagged_chunks = tag_chunks_with_pp(tagged_chunks, list(projects_by_name.values()))
-
-print("\n📌 Step 8: Section coverage analysis...")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("portfolio")
+    parser.add_argument("opportunity")
+    parser.add_argument("--force-capture", action="store_true")
+    parser.add_argument("--skip-download", action="store_true",
+                        help="Use the files already in the local solicitation folder instead of syncing from S3")
+    parser.add_argument("--test-limit", type=int, default=None)
+    parser.add_argument("--max-in-flight", type=int, default=None, help="Max concurrent Claude requests per tagger")
+    parser.add_argument("--doc-workers", type=int, default=None, help="Worker processes for document parsing")
+    parser.add_argument("--no-doc-cache", action="store_true", help="Re-parse documents instead of using the parse cache")
+    parser.add_argument("--max-stages", type=int, default=6, help="Max pipeline stages running at once")
+    parser.add_argument("--fused-tagging", action="store_true",
+                        help="Tag expectation, eval criteria and win themes with one Claude call per chunk")
+    parser.add_argument("--batch-tokens", type=int, default=None,
+                        help="Pack chunks into multi-chunk prompts of about this many tokens (expectation + eval taggers)")
+    parser.add_argument("--pp-top-k", type=int, default=None,
+                        help="Past performance projects shortlisted per chunk before Claude (0 = assess every pair)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Reuse tags from the previous tagged chunks artifact and only tag new or changed chunks")
+    parser.add_argument("--no-llm-cache", action="store_true", help="Bypass the on-disk Claude response cache")
+    parser.add_argument("--no-llm-routing", action="store_true",
+                        help="Send every task to the large model tier instead of the per-task routing table")
+    parser.add_argument("--llm-mode", choices=["live", "record", "replay"], default=None,
+                        help="live calls Bedrock; record also appends every call to the recordings file; "
+                             "replay serves recorded responses offline (default: LLM_MODE env or live)")
+    parser.add_argument("--llm-recordings", default=None,
+                        help="Recordings JSONL for --llm-mode record/replay (default: LLM_RECORDINGS_PATH or .cache/llm_recordings.jsonl)")
+    parser.add_argument("--metrics-prom", action="store_true",
+                        help="Also write run_metrics.prom (Prometheus text format) next to run_report.json")
+    parser.add_argument("--compliance-full-scan", action="store_true",
+                        help="Send whole chunks to the compliance tagger instead of only requirement-bearing sentences")
+    parser.add_argument("--eval-cascade", action="store_true",
+                        help="Score confident eval-criteria negatives with the local classifier and only send the rest to Claude")
+    parser.add_argument("--legacy-json", action="store_true",
+                        help="Also export tagged_chunks.json (indented array) next to tagged_chunks.jsonl")
+    parser.add_argument("--resume", action="store_true",
+                        help="Replay checkpoint.jsonl from an interrupted run and only schedule the missing work")
+    return parser.parse_args(argv)
+
+
 def perform_section_coverage_analysis(tagged_chunks, parsed_context, portfolio, opportunity):
     print("\n🔍 Analyzing section coverage gaps...")
     covered_section_ids = set()
@@ -155,24 +109,330 @@ def perform_section_coverage_analysis(tagged_chunks, parsed_context, portfolio,
     with open(gap_report_path, "w", encoding="utf-8") as f:
         json.dump(uncovered_sections, f, indent=2)
     print(f"\n📅 Coverage gap report saved to: {gap_report_path}")
+    return uncovered_sections
+
+
+def build_stages(args, checkpoint: CheckpointLog, writer: ChunkWriter):
+    """
+    Declare the Phase 1 pipeline as stages with explicit inputs/outputs.
+    Taggers annotate the shared chunk dicts in place (each writes its own agent_tags key),
+    so their outputs are completion markers rather than copies of the chunk list.
+    Every per-chunk result is appended to the checkpoint log as it arrives, and a chunk is
+    streamed to tagged_chunks.jsonl as soon as all of its tagging agents have finished.
+    """
+    portfolio = args.portfolio
+    opportunity = args.opportunity
+    local_folder = get_local_folder(portfolio, opportunity)
+    output_dir = f"data/{portfolio}/opportunities/{opportunity}"
+    bucket = os.getenv("S3_BUCKET")
+    max_in_flight = args.max_in_flight
+    pp_top_k = PP_TOP_K if args.pp_top_k is None else (args.pp_top_k or None)
+
+    def set_tag(agent):
+        def apply(chunk, result):
+            chunk["metadata"].setdefault("agent_tags", {})[agent] = result
+        return apply
+
+    def set_fused_tags(chunk, result):
+        chunk["metadata"].setdefault("agent_tags", {}).update(result)
+
+    def set_pp_tag(chunk, result):
+        if result:
+            chunk["metadata"].setdefault("agent_tags", {})["pp_matcher"] = result
+
+    # Chunk-level completion tracking for streaming the JSONL artifact
+    tag_stages = {"fused_tagger"} if args.fused_tagging else {"expectation_identifier", "eval_criteria_identifier", "win_theme_mapper"}
+    tag_stages.add("pp_matcher")
+    chunks_by_id = {}
+    finished_stages = defaultdict(set)
+    written_ids = set()
+    track_lock = threading.Lock()
+
+    def track(stage):
+        record = checkpoint.recorder(stage)
+
+        def on_tagged(chunk_id, result):
+            record(chunk_id, result)
+            with track_lock:
+                finished_stages[chunk_id].add(stage)
+                if finished_stages[chunk_id] < tag_stages or chunk_id in written_ids:
+                    return
+                written_ids.add(chunk_id)
+            writer.write(chunks_by_id[chunk_id])
+        return on_tagged
+
+    def resume_stage(stage, chunks, apply):
+        remaining, replayed = checkpoint.split_pending(stage, chunks, apply)
+        if replayed:
+            print(f"♻️ [{stage}] {replayed} chunks restored from checkpoint, {len(remaining)} left to run")
+        return remaining
+
+    def download_solicitation():
+        if args.skip_download:
+            print(f"\n🗓️ Skipping S3 sync; using local files in {local_folder}")
+            return {"solicitation_folder": local_folder}
+        print(f"\n🗓️ Downloading S3 files for {portfolio}/{opportunity} ...")
+        sync_s3_prefix(bucket, get_s3_prefix(portfolio, opportunity), local_folder)
+        return {"solicitation_folder": local_folder}
+
+    def load_solicitation(solicitation_folder):
+        print("\n📄 Loading solicitation documents...")
+        file_paths = [p for p in list_local_files(solicitation_folder) if not Path(p).name.lower().startswith("capture")]
+        return {"docs": load_documents(file_paths, max_workers=args.doc_workers, use_cache=not args.no_doc_cache)}
+
+    def chunk_solicitation(docs):
+        print("\n📚 Chunking, extracting TOC/sections and enriching chunks with breadcrumbs...")
+        chunks = chunk_documents(docs, opportunity_name=opportunity)
+        full_text = "\n\n".join([doc.page_content for doc in docs])
+        page_breaks = page_breaks_from_docs(docs)
+        parsed_context = extract_toc_and_sections(full_text, page_breaks=page_breaks)
+        save_parsed_context(parsed_context, os.path.join(output_dir, "parsed_context.json"))
+        section_map = {s["id"]: s for s in parsed_context["sections"] if "id" in s}
+        chunks = assign_sections(chunks, parsed_context, page_breaks=page_breaks)
+        chunks = enrich_chunks_with_breadcrumbs(chunks, section_map)
+        if args.test_limit:
+            chunks = chunks[:args.test_limit]
+
+        # Chunks the agents still need to see (everything, unless --incremental finds prior tags)
+        pending_chunks = chunks
+        if args.incremental:
+            previous_path = resolve_chunks_path(get_tagged_chunks_jsonl_path(portfolio, opportunity))
+            previous_chunks = list(iter_chunks(previous_path)) if os.path.exists(previous_path) else []
+            pending_chunks = carry_forward_tags(chunks, previous_chunks)
+            print(f"♻️ Incremental: {len(chunks) - len(pending_chunks)} chunks carried forward, {len(pending_chunks)} to tag")
+        chunks_by_id.update((c["chunk_id"], c) for c in chunks)
+        return {"chunks": chunks, "pending_chunks": pending_chunks, "parsed_context": parsed_context}
+
+    def parse_capture(solicitation_folder):
+        print("\n🎯 Parsing capture files...")
+        capture_path = get_capture_json_path(portfolio, opportunity)
+        if args.force_capture or not os.path.exists(capture_path):
+            capture_data = parse_all_capture_files(solicitation_folder)
+            save_capture_json(capture_data, capture_path)
+        else:
+            with open(capture_path, "r", encoding="utf-8") as f:
+                capture_data = json.load(f)
+
+        grouped_capture_data = {
+            "pain_points": [c["text"] for c in capture_data if c["section"] == "pain_points"],
+            "win_themes": [c["text"] for c in capture_data if c["section"] == "win_themes"],
+            "differentiators": [c["text"] for c in capture_data if c["section"] == "discriminators"]
+        } if isinstance(capture_data, list) else capture_data
+        return {"capture_context": grouped_capture_data}
+
+    def extract_past_performance():
+        print("\n📂 Extracting past performance metadata...")
+        pp_folder = f"data/{portfolio}/opportunities/{opportunity}/past_performance/"
+        pp_docs = load_documents(list_local_files(pp_folder), max_workers=args.doc_workers,
+                                 use_cache=not args.no_doc_cache)
+        projects_by_name = {}
+        for doc in pp_docs:
+            fname = Path(doc.metadata.get("source", "unknown")).name
+            metadata = extract_project_metadata(doc.page_content, fname)
+            if not metadata:
+                continue
+            cid = metadata.get("contract_identification")
+            if not cid:
+                continue
+            pname = infer_project_name(cid, fname)
+            key = pname.strip().lower()
+            projects_by_name[key] = merge_projects(projects_by_name.get(key, {}), metadata)
+        projects = list(projects_by_name.values())
+        with open(get_past_perf_json_path(portfolio, opportunity), "w", encoding="utf-8") as f:
+            json.dump(projects, f, indent=2)
+        return {"past_perf_projects": projects}
+
+    def tag_expectations(pending_chunks, capture_context):
+        remaining = resume_stage("expectation_identifier", pending_chunks, set_tag("expectation_identifier"))
+        tag_expectation_identifier(remaining, capture_context=capture_context,
+                                   max_in_flight=max_in_flight, batch_tokens=args.batch_tokens,
+                                   on_tagged=track("expectation_identifier"))
+        return {"expectation_tags": True}
+
+    def tag_eval_criteria(pending_chunks):
+        on_tagged = track("eval_criteria_identifier")
+        to_claude, cascade = pending_chunks, None
+        if args.eval_cascade:
+            # Runs before the checkpoint replay so locally settled chunks keep their agent_sources marker
+            to_claude, cascade = cascade_eval_criteria(pending_chunks, on_tagged=on_tagged)
+        remaining = resume_stage("eval_criteria_identifier", to_claude, set_tag("eval_criteria_identifier"))
+        tag_eval_criteria_chunks(remaining, max_in_flight=max_in_flight, batch_tokens=args.batch_tokens,
+                                 on_tagged=on_tagged)
+        if cascade:
+            save_cascade_report(cascade_report(pending_chunks, cascade), os.path.join(output_dir, "cascade_report.json"))
+        return {"eval_criteria_tags": True}
+
+    def tag_win_themes(chunks, pending_chunks, capture_context, eval_criteria_tags):
+        criteria_text = "\n\n".join([c["text"] for c in chunks if c["metadata"]["agent_tags"].get("eval_criteria_identifier", 0.0) >= 0.7])
+        remaining = resume_stage("win_theme_mapper", pending_chunks, set_tag("win_theme_mapper"))
+        tag_win_theme_mapper(remaining, capture_context, criteria_text, max_in_flight=max_in_flight,
+                             on_tagged=track("win_theme_mapper"))
+        return {"win_theme_tags": True}
+
+    def tag_fused(pending_chunks, capture_context):
+        # Eval criteria are scored in the same call, so there is no criteria text to feed win themes up front
+        remaining = resume_stage("fused_tagger", pending_chunks, set_fused_tags)
+        tag_chunks_fused(remaining, capture_context, max_in_flight=max_in_flight,
+                         on_tagged=track("fused_tagger"))
+        return {"expectation_tags": True, "eval_criteria_tags": True, "win_theme_tags": True}
+
+    def tag_past_performance(pending_chunks, past_perf_projects):
+        remaining = resume_stage("pp_matcher", pending_chunks, set_pp_tag)
+        tag_chunks_with_pp(remaining, past_perf_projects, max_in_flight=max_in_flight, top_k=pp_top_k,
+                           on_tagged=track("pp_matcher"))
+        return {"pp_tags": True}
+
+    def tag_compliance(chunks, pending_chunks):
+        restored = {}
+        remaining = resume_stage("compliance_tagger", pending_chunks,
+                                 lambda chunk, result: restored.__setitem__(chunk["chunk_id"], result))
+        new_response, new_performance = tag_compliance_chunks(remaining, max_in_flight=max_in_flight,
+                                                              on_tagged=checkpoint.recorder("compliance_tagger"),
+                                                              full_scan=args.compliance_full_scan or None)
+
+        # Re-assemble restored and fresh requirements in chunk order
+        fresh = defaultdict(lambda: {"proposal_response": [], "project_performance": []})
+        for r in new_response:
+            fresh[r.get("chunk_id")]["proposal_response"].append(r)
+        for r in new_performance:
+            fresh[r.get("chunk_id")]["project_performance"].append(r)
+        compliance_response, compliance_performance = [], []
+        for chunk in pending_chunks:
+            items = restored.get(chunk["chunk_id"]) or fresh.get(chunk["chunk_id"])
+            if items:
+                compliance_response.extend(items["proposal_response"])
+                compliance_performance.extend(items["project_performance"])
+
+        os.makedirs(output_dir, exist_ok=True)
+        if args.incremental:
+            # Keep previous requirements for chunks that are still present and were not re-tagged
+            kept_ids = {c["chunk_id"] for c in chunks} - {c["chunk_id"] for c in pending_chunks}
+            previous_response = load_previous_chunks(os.path.join(output_dir, "compliance_response.json"))
+            previous_performance = load_previous_chunks(os.path.join(output_dir, "compliance_performance.json"))
+            compliance_response = [r for r in previous_response if r.get("chunk_id") in kept_ids] + compliance_response
+            compliance_performance = [r for r in previous_performance if r.get("chunk_id") in kept_ids] + compliance_performance
+        with open(os.path.join(output_dir, "compliance_response.json"), "w") as f:
+            json.dump(compliance_response, f, indent=2)
+        with open(os.path.join(output_dir, "compliance_performance.json"), "w") as f:
+            json.dump(compliance_performance, f, indent=2)
+        return {"compliance": (compliance_response, compliance_performance)}
+
+    def consolidate_compliance(compliance):
+        print("\n🧹 Consolidating near-duplicate compliance requirements...")
+        matrix = build_compliance_matrix(*compliance)
+        save_compliance_matrix(matrix, os.path.join(output_dir, "compliance_matrix.json"))
+        return {"compliance_matrix": matrix}
+
+    def save_tagged_chunks(chunks, parsed_context, expectation_tags, eval_criteria_tags, win_theme_tags, pp_tags):
+        print("\n📌 Section coverage analysis...")
+        perform_section_coverage_analysis(chunks, parsed_context, portfolio, opportunity)
+
+        # Carried-forward, checkpoint-restored and failed chunks have not been streamed yet
+        with track_lock:
+            remaining = [c for c in chunks if c["chunk_id"] not in written_ids]
+            written_ids.update(c["chunk_id"] for c in remaining)
+        for chunk in remaining:
+            writer.write(chunk)
+        writer.close()
+        print(f"💾 Saved {writer.count} tagged chunks to: {writer.path}")
+
+        if args.legacy_json:
+            export_chunks_json(get_tagged_chunks_path(portfolio, opportunity), chunks)
+            print(f"💾 Exported legacy JSON to: {get_tagged_chunks_path(portfolio, opportunity)}")
+        return {"tagged_chunks": chunks}
+
+    def keyword_analysis(tagged_chunks):
+        print("\n📌 Keyword/Theme Frequency Analysis...")
+        keyword_result = analyze_keywords_from_chunks(tagged_chunks, portfolio, opportunity)
+        keyword_path = os.path.join(output_dir, "keyword_themes.json")
+        with open(keyword_path, "w", encoding="utf-8") as f:
+            json.dump(keyword_result, f, indent=2)
+        print(f"📊 Saved keyword themes to: {keyword_path}")
+        return {"keyword_themes": keyword_result}
+
+    stages = [
+        Stage("download_solicitation", download_solicitation, (), ("solicitation_folder",)),
+        Stage("load_solicitation", load_solicitation, ("solicitation_folder",), ("docs",)),
+        Stage("chunk_solicitation", chunk_solicitation, ("docs",), ("chunks", "pending_chunks", "parsed_context")),
+        Stage("parse_capture", parse_capture, ("solicitation_folder",), ("capture_context",)),
+        Stage("extract_past_performance", extract_past_performance, (), ("past_perf_projects",)),
+        Stage("tag_past_performance", tag_past_performance, ("pending_chunks", "past_perf_projects"), ("pp_tags",)),
+        Stage("tag_compliance", tag_compliance, ("chunks", "pending_chunks"), ("compliance",)),
+        Stage("consolidate_compliance", consolidate_compliance, ("compliance",), ("compliance_matrix",)),
+        Stage("save_tagged_chunks", save_tagged_chunks,
+              ("chunks", "parsed_context", "expectation_tags", "eval_criteria_tags", "win_theme_tags", "pp_tags"),
+              ("tagged_chunks",)),
+        Stage("keyword_analysis", keyword_analysis, ("tagged_chunks",), ("keyword_themes",)),
+    ]
+    if args.fused_tagging:
+        stages.append(Stage("tag_fused", tag_fused, ("pending_chunks", "capture_context"),
+                            ("expectation_tags", "eval_criteria_tags", "win_theme_tags")))
+    else:
+        stages += [
+            Stage("tag_expectations", tag_expectations, ("pending_chunks", "capture_context"), ("expectation_tags",)),
+            Stage("tag_eval_criteria", tag_eval_criteria, ("pending_chunks",), ("eval_criteria_tags",)),
+            Stage("tag_win_themes", tag_win_themes,
+                  ("chunks", "pending_chunks", "capture_context", "eval_criteria_tags"), ("win_theme_tags",)),
+        ]
+    return stages
+
+
+def main(argv=None):
+    start_time = time.time()
+    args = parse_args(argv)
+    if args.llm_mode or args.llm_recordings:
+        set_llm_mode(args.llm_mode, args.llm_recordings)
+    if args.no_llm_cache:
+        set_cache_enabled(False)
+    if args.no_llm_routing:
+        set_llm_routing(False)
+
+    metrics.REGISTRY.reset()
+    checkpoint = CheckpointLog(get_checkpoint_path(args.portfolio, args.opportunity), resume=args.resume)
+    writer = ChunkWriter(get_tagged_chunks_jsonl_path(args.portfolio, args.opportunity))
+    stages = build_stages(args, checkpoint, writer)
+    status = "failed"
+    try:
+        run_stage_graph(stages, max_workers=args.max_stages)
+        status = "complete"
+    finally:
+        checkpoint.close()
+        # A failed run must not replace the previous complete artifact with a partial one
+        if status == "complete":
+            writer.close(create_if_empty=False)
+        else:
+            writer.abort()
+        # Written for failed runs too, so a crash still shows where the time and tokens went
+        output_dir = f"data/{args.portfolio}/opportunities/{args.opportunity}"
+        report = metrics.build_run_report(stages, extra={
+            "run": {"portfolio": args.portfolio, "opportunity": args.opportunity, "status": status,
+                    "wall_s": round(time.time() - start_time, 3), "argv": list(argv) if argv else sys.argv[1:]},
+            "cache": cache_stats(),
+        })
+        metrics.save_run_report(report, os.path.join(output_dir, "run_report.json"),
+                                os.path.join(output_dir, "run_metrics.prom") if args.metrics_prom else None)
+    print_timing_summary(stages)
+
+    totals = report["models"].values()
+    print(f"\n💰 LLM usage: {sum(m['llm_calls'] for m in totals)} calls, "
+          f"{sum(m['input_tokens'] for m in totals):,} input / {sum(m['output_tokens'] for m in totals):,} output tokens, "
+          f"${sum(m['cost_usd'] for m in totals):.2f}")
+    for model_id, m in sorted(report["models"].items()):
+        p50 = m.get("latency_s", {}).get("p50", 0.0)
+        print(f"   - {model_id}: {m['llm_calls']} calls, ${m['cost_usd']:.2f}, p50 latency {p50:.2f}s")
+    escalations = metrics.REGISTRY.counter_total("llm_escalations_total")
+    if escalations:
+        print(f"   ↗️ {int(escalations)} answers escalated to the large model tier")
 
-perform_section_coverage_analysis(tagged_chunks, parsed_context, portfolio, opportunity)
+    print("\n📌 [TODO] Scoring rubric mapping – NOT IMPLEMENTED YET")
+    print("\n📌 [TODO] Tone & style profiling – NOT IMPLEMENTED YET")
 
-tagged_output_path = get_tagged_chunks_path(portfolio, opportunity)
-os.makedirs(os.path.dirname(tagged_output_path), exist_ok=True)
-with open(tagged_output_path, "w", encoding="utf-8") as f:
-    json.dump(tagged_chunks, f, indent=2)
+    stats = cache_stats()
+    print(f"\n💾 LLM cache: {stats['hits']} hits, {stats['misses']} misses (hit rate {stats['hit_rate']})")
 
-print("\n📌 [TODO] Scoring rubric mapping – NOT IMPLEMENTED YET")
-print("\n📌 [TODO] Tone & style profiling – NOT IMPLEMENTED YET")
+    total_time = round(time.time() - start_time, 2)
+    print(f"\n📅 Phase 1: Solicitation Analysis complete in {total_time} seconds.")
 
-print("\n📌 Step 13: Keyword/Theme Frequency Analysis...")
-keyword_result = analyze_keywords_from_chunks(tagged_chunks, portfolio, opportunity)
-keyword_path = os.path.join(output_dir, "keyword_themes.json")
-with open(keyword_path, "w", encoding="utf-8") as f:
-    json.dump(keyword_result, f, indent=2)
-print(f"📊 Saved keyword themes to: {keyword_path}")
 
-end_time = time.time()
-total_time = round(end_time - start_time, 2)
-print(f"\n📅 Phase 1: Solicitation Analysis complete in {total_time} seconds.")
+if __name__ == "__main__":
+    main()
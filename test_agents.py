@@ -15,9 +15,10 @@ from rag.solicitation_tagging import (
 from rag.pp_matcher import tag_chunks_with_pp
 from rag.compliance_tagger import tag_compliance_chunks
 from rag.project_paths import (
-    get_tagged_chunks_path, get_eval_criteria_path,
+    get_tagged_chunks_jsonl_path, get_eval_criteria_path,
     get_capture_json_path, get_past_perf_json_path, get_local_folder
 )
+from rag.chunk_store import iter_chunks, resolve_chunks_path, write_chunks_jsonl
 
 load_dotenv(dotenv_path=".env.local")
 
@@ -33,8 +34,7 @@ opportunity = args.opportunity
 base_path = get_local_folder(portfolio, opportunity)
 
 # === Load chunks ===
-with open(get_tagged_chunks_path(portfolio, opportunity), "r", encoding="utf-8") as f:
-    chunks = json.load(f)
+chunks = list(iter_chunks(resolve_chunks_path(get_tagged_chunks_jsonl_path(portfolio, opportunity))))
 if args.limit:
     chunks = chunks[:args.limit]
 
@@ -129,8 +129,7 @@ for chunk_list in all_chunks:
         merged[chunk["chunk_id"]].update(chunk)
 
 # === Save ===
-with open(get_tagged_chunks_path(portfolio, opportunity), "w", encoding="utf-8") as f:
-    json.dump(list(merged.values()), f, indent=2)
+write_chunks_jsonl(get_tagged_chunks_jsonl_path(portfolio, opportunity), merged.values())
 
 print("\n⏱️ Agent Timing Summary:")
 for name, sec in sorted(timings.items(), key=lambda x: x[1], reverse=True):